@@ -0,0 +1,280 @@
+"""
+Times the analyses in visualizer.py on synthetic Airbnb snapshots. Every function is run once in its own fresh
+process, which measures the time and the peak resident memory of that call, and the results are written to a JSON
+file that later runs can be compared against.
+
+    python benchmark.py --rows 10000 100000 1000000 --output bench.json
+    python benchmark.py --rows 1000000 --baseline bench.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import visualizer
+
+# the columns of a synthetic snapshot, in the order they are written
+HEADER = ["room_id", "host_id", "room_type", "neighborhood", "reviews", "overall_satisfaction", "price"]
+
+ROOM_TYPES = ["Entire home/apt", "Private room", "Shared room"]
+
+# the functions that are timed, in the order they are run
+FUNCTIONS = ["price_satisfaction", "correlation", "host_listings", "num_listings", "room_prices", "price_change",
+             "price_by_neighborhood"]
+
+
+def generate_snapshots(folder, rows, snapshots=3, host_skew=1.5, commercial_share=0.2, neighborhoods=50, seed=0):
+    """
+    This function writes synthetic snapshots of the same rooms on consecutive months, named like real snapshots
+    ("synthetic_2015-01-01.csv"). Most listings belong to a host with one listing, and commercial_share of them
+    belong to hosts drawn from a Zipf distribution, so a few hosts have very many listings.
+
+    :param folder: the folder to write the files to (str)
+    :param rows: the number of listings in each snapshot (int)
+    :param snapshots: the number of snapshots to write (int)
+    :param host_skew: the exponent of the Zipf distribution of commercial hosts, larger than 1 (float)
+    :param commercial_share: the share of listings that belong to commercial hosts (float)
+    :param neighborhoods: the number of neighborhoods (int)
+    :param seed: the seed of the random numbers (int)
+    :return: the file names of the snapshots, oldest first (list)
+    """
+    rng = np.random.default_rng(seed)
+    room_id = np.arange(1, rows + 1, dtype=np.int64) * 7
+    # gives single-listing hosts their own ids and commercial hosts small, skewed ids
+    commercial = rng.random(rows) < commercial_share
+    host_id = np.where(commercial, rng.zipf(host_skew, rows), rows + np.arange(rows)).astype(np.int64)
+    room_type = np.array(ROOM_TYPES, dtype=object)[rng.choice(len(ROOM_TYPES), rows, p=[0.6, 0.35, 0.05])]
+    neighborhood = np.array(["Neighborhood %d" % i for i in range(neighborhoods)], dtype=object)[
+        np.minimum(rng.zipf(1.3, rows) - 1, neighborhoods - 1)]
+    price = np.round(rng.lognormal(4.5, 0.6, rows))
+
+    filenames = []
+    for month in range(snapshots):
+        reviews = rng.poisson(8, rows)
+        satisfaction = np.where(reviews > 0, np.round(rng.uniform(2.5, 5.0, rows) * 2) / 2, 0.0)
+        # lets prices drift a little from one snapshot to the next
+        price = np.maximum(np.round(price * rng.normal(1.0, 0.05, rows)), 10)
+        filename = os.path.join(folder, "synthetic_%d-%02d-01.csv" % (2015 + month // 12, month % 12 + 1))
+        columns = [room_id, host_id, room_type, neighborhood, reviews, satisfaction, price]
+        with open(filename, "w") as file_out:
+            file_out.write(",".join(HEADER) + "\n")
+            # turns the rows into text and writes them a block at a time to keep memory down for large snapshots
+            for start in range(0, rows, 100000):
+                block = [column[start:start + 100000].astype(str) for column in columns]
+                file_out.write("\n".join(map(",".join, zip(*block))) + "\n")
+        filenames.append(filename)
+    return filenames
+
+
+def _call(name, filenames, argument):
+    """
+    This function calls one function of visualizer.py.
+
+    :param name: the name of the function in FUNCTIONS (str)
+    :param filenames: the synthetic snapshots, oldest first (list)
+    :param argument: the input prepared for correlation, num_listings and price_change (object)
+    """
+    filename = filenames[-1]
+    if name == "price_satisfaction":
+        visualizer.price_satisfaction(filename)
+    elif name == "correlation":
+        visualizer.correlation(argument)
+    elif name == "host_listings":
+        visualizer.host_listings(filename)
+    elif name == "num_listings":
+        visualizer.num_listings(argument)
+    elif name == "room_prices":
+        visualizer.room_prices(filenames, "Entire home/apt")
+    elif name == "price_change":
+        visualizer.price_change(argument)
+    elif name == "price_by_neighborhood":
+        visualizer.price_by_neighborhood(filename)
+
+def _resident_mb():
+    """
+    This function reads the resident memory of this process from /proc, which only Linux has.
+
+    :return: a tuple of the resident memory now (float) and at its peak (float), in MB (tuple)
+    """
+    with open("/proc/self/status") as file_in:
+        fields = dict(line.split(":", 1) for line in file_in)
+    # the values are in kilobytes
+    return (int(fields["VmRSS"].split()[0]) / 2 ** 10, int(fields["VmHWM"].split()[0]) / 2 ** 10)
+
+def _max_resident_mb():
+    """
+    This function reads the peak resident memory of this process since it started.
+
+    :return: the peak resident memory in MB (float)
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 2 ** 10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+def _reset_peak():
+    """
+    This function sets the peak resident memory of this process back to its current resident memory, so the peak
+    read afterwards belongs to what runs next. Only Linux can do this.
+
+    :return: whether the peak was reset (bool)
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file_out:
+            file_out.write("5")
+    except OSError:
+        return False
+    return True
+
+def _run(name, filenames, use_cache):
+    """
+    This function times one function of visualizer.py. The input it needs from other functions is prepared first
+    and isn't timed, and the snapshots it loaded are forgotten before the call, so the call starts from the same
+    state as when it is used on its own. The memory of the call is how far the resident memory of the process rose
+    above what it was just before the call. On Linux the peak is reset before the call; elsewhere ru_maxrss is read
+    before and after, which misses a call that stays under the peak the preparation already reached.
+
+    :param name: the name of the function in FUNCTIONS (str)
+    :param filenames: the synthetic snapshots, oldest first (list)
+    :param use_cache: whether the binary snapshot cache may be used; it is filled before anything is timed (bool)
+    :return: a tuple of the seconds taken (float) and the peak memory added by the call in MB (float)
+    """
+    if use_cache:
+        # writes the binary copies first, so the timed call reads them
+        for filename in filenames:
+            visualizer.load_snapshot(filename)
+    else:
+        visualizer.CACHE_DIR = ""
+    # keeps no results, so the timed call computes its result even when its input was prepared the same way
+    visualizer.RESULT_CACHE = visualizer.ResultCache(max_entries=0)
+    argument = None
+    if name == "correlation":
+        argument = visualizer.price_satisfaction(filenames[-1])
+    elif name == "num_listings":
+        argument = visualizer.host_listings(filenames[-1])
+    elif name == "price_change":
+        argument = visualizer.room_prices(filenames, "Entire home/apt")
+
+    for filename in filenames:
+        visualizer.forget_snapshot(filename)
+    reset = _reset_peak()
+    before = _resident_mb()[0] if reset else _max_resident_mb()
+    start = time.perf_counter()
+    _call(name, filenames, argument)
+    seconds = time.perf_counter() - start
+    peak = _resident_mb()[1] if reset else _max_resident_mb()
+    return (seconds, max(peak - before, 0.0))
+
+
+def measure(name, filenames, use_cache=False, repeat=1):
+    """
+    This function runs _run in a new process repeat times and keeps the fastest run.
+
+    :param name: the name of the function in FUNCTIONS (str)
+    :param filenames: the synthetic snapshots, oldest first (list)
+    :param use_cache: whether the binary snapshot cache may be used (bool)
+    :param repeat: the number of runs (int)
+    :return: a tuple of the seconds taken (float) and the peak memory added by the call in MB (float) of the
+    fastest run
+    """
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        with context.Pool(1) as pool:
+            runs.append(pool.apply(_run, (name, filenames, use_cache)))
+    return min(runs)
+
+
+def run_benchmarks(row_counts, functions=FUNCTIONS, snapshots=3, host_skew=1.5, use_cache=False, repeat=1, seed=0):
+    """
+    This function generates snapshots of each size and times every function on them.
+
+    :param row_counts: the numbers of listings per snapshot to benchmark (list)
+    :param functions: the names of the functions to time (list)
+    :param snapshots: the number of snapshots room_prices and price_change get (int)
+    :param host_skew: the exponent of the Zipf distribution of commercial hosts (float)
+    :param use_cache: whether the binary snapshot cache may be used (bool)
+    :param repeat: the number of runs of each function, the fastest is kept (int)
+    :param seed: the seed of the random numbers (int)
+    :return: a list of dictionaries, one per function and size (list)
+    """
+    results = []
+    for rows in row_counts:
+        with tempfile.TemporaryDirectory() as folder:
+            filenames = generate_snapshots(folder, rows, snapshots, host_skew, seed=seed)
+            for name in functions:
+                seconds, peak = measure(name, filenames, use_cache, repeat)
+                # room_prices and price_change cover every snapshot, the other functions one
+                processed = rows * snapshots if name in ("room_prices", "price_change") else rows
+                result = {"function": name, "rows": processed, "seconds": seconds,
+                          "rows_per_second": processed / seconds if seconds > 0 else float("inf"),
+                          "peak_rss_mb": peak}
+                print("%-22s %10d rows %9.3f s %14.0f rows/s %9.1f MB" % (
+                    name, processed, seconds, result["rows_per_second"], peak))
+                results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    This function finds the results that got slower than the same function and size in a baseline run.
+
+    :param results: the results of this run (list)
+    :param baseline: the results of an earlier run (list)
+    :param tolerance: how much slower a result may be before it counts, 0.2 for 20% (float)
+    :return: a list of tuples of function name (str), rows (int), old seconds (float) and new seconds (float)
+    """
+    old = {(result["function"], result["rows"]): result["seconds"] for result in baseline}
+    regressions = []
+    for result in results:
+        key = (result["function"], result["rows"])
+        if key in old and result["seconds"] > old[key] * (1 + tolerance):
+            regressions.append((key[0], key[1], old[key], result["seconds"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark visualizer.py on synthetic snapshots.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="listings per snapshot")
+    parser.add_argument("--functions", nargs="+", default=FUNCTIONS, choices=FUNCTIONS, help="functions to time")
+    parser.add_argument("--snapshots", type=int, default=3, help="snapshots for room_prices and price_change")
+    parser.add_argument("--host-skew", type=float, default=1.5, help="Zipf exponent of commercial hosts")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per function, the fastest is kept")
+    parser.add_argument("--cache", action="store_true", help="let the binary snapshot cache be used")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random numbers")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file to write the results to")
+    parser.add_argument("--baseline", default=None, help="JSON file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown allowed before a regression")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.rows, args.functions, args.snapshots, args.host_skew, args.cache, args.repeat,
+                             args.seed)
+    report = {
+        "meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "numpy": np.__version__, "machine": platform.machine(), "cpus": os.cpu_count(),
+                 "snapshots": args.snapshots, "host_skew": args.host_skew, "cache": args.cache, "seed": args.seed},
+        "results": results,
+    }
+    with open(args.output, "w") as file_out:
+        json.dump(report, file_out, indent=2)
+
+    # fails the run when something got slower than the baseline allows
+    if args.baseline:
+        with open(args.baseline) as file_in:
+            regressions = compare(results, json.load(file_in)["results"], args.tolerance)
+        for name, rows, old, new in regressions:
+            print("regression: %s on %d rows took %.3f s, was %.3f s" % (name, rows, new, old))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
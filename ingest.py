@@ -0,0 +1,401 @@
+"""
+Watches a folder of snapshots and keeps the analyses of visualizer.py up to date as new <city>_<date>.csv files land
+in it. Only each new file is read; its results are added to the per-city correlations, host histograms, neighborhood
+price statistics and room price histories that are already there. The current results are served as JSON on a small
+local HTTP API:
+
+    GET /cities                                       cities and the dates of their snapshots
+    GET /correlation?city=boston                      correlation and pvalue per snapshot, and the rolling value
+    GET /hosts?city=boston[&date=2015-01-02]          number of hosts with i listings, latest snapshot by default
+    GET /neighborhoods?city=boston[&date=...][&room_type=Entire home/apt]
+                                                      price statistics per neighborhood
+    GET /prices?city=boston&room_id=123               price history of a room
+    GET /movers?city=boston[&room_type=Shared room][&k=100][&by=total]
+                                                      rooms whose price moved the most
+
+    python ingest.py snapshots/ --port 8765
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import visualizer
+
+
+def _init_worker():
+    """
+    This function sets up a worker process of the service like visualizer.init_worker. The binary snapshot cache is
+    turned off, since each snapshot is read once and keeping a copy of every scrape would fill the disk over the life
+    of the service.
+    """
+    visualizer.init_worker()
+    visualizer.CACHE_DIR = ""
+
+
+def summarize_snapshot(filename):
+    """
+    This function reads one snapshot and returns the parts of it the service keeps. It runs in a worker process,
+    which forgets the snapshot once it is summarized.
+
+    :param filename: a string that is a file name (str)
+    :return: a dictionary with the snapshot's city and date, its price and rating arrays, its host histogram, its
+    price statistics per (room type, neighborhood), and its room ids, room types and prices (dict)
+    """
+    try:
+        snapshot = visualizer.load_snapshot(filename)
+        satisfaction = snapshot["overall_satisfaction"]
+        # keeps the listings that have at least one review, a rating and a price, like price_satisfaction
+        rated = (snapshot["reviews"] > 0) & ~np.isnan(satisfaction) & ~np.isnan(snapshot["price"])
+        return {
+            "city": visualizer.snapshot_city(filename),
+            "date": visualizer.snapshot_date(filename),
+            "prices": snapshot["price"][rated],
+            "ratings": satisfaction[rated],
+            "hosts": visualizer.listings_histogram(filename),
+            "neighborhoods": visualizer.group_stats((snapshot["room_type"], snapshot["neighborhood"]),
+                                                    snapshot["price"]),
+            "room_ids": np.asarray(snapshot["room_id"]),
+            "room_types": snapshot["room_type"],
+            "room_prices": np.asarray(snapshot["price"]),
+        }
+    finally:
+        visualizer.forget_snapshot(filename)
+
+
+class IngestState:
+    """
+    This class holds the results of every snapshot ingested so far, per city, and answers the queries of the API.
+    """
+
+    def __init__(self, window=3):
+        """
+        :param window: the number of most recent snapshots the rolling correlation covers (int)
+        """
+        self.window = window
+        self.cities = {}
+
+    def _city(self, city):
+        """
+        :param city: a city (str)
+        :return: the results of the city, made empty the first time (dict)
+        """
+        if city not in self.cities:
+            self.cities[city] = {"dates": [], "correlations": {}, "sizes": {}, "hosts": {}, "neighborhoods": {},
+                                 "histories": {}, "movers": {}}
+        return self.cities[city]
+
+    def merge_histories(self, summary):
+        """
+        This function adds the prices of one snapshot to copies of the room price histories of its city, in date
+        order. The histories in use are only read, so this can run in a thread while the API keeps answering from
+        them; ingest then swaps the copies in.
+
+        :param summary: the summary of the snapshot (dict)
+        :return: a dictionary mapping each room type of the snapshot (str) to its new histories (dict)
+        """
+        old = self.cities.get(summary["city"], {})
+        date = summary["date"]
+        if date in old.get("correlations", {}):
+            return {}
+        histories = old.get("histories", {})
+        merged = {}
+        for room_id, room_type, price in zip(summary["room_ids"].tolist(), summary["room_types"].tolist(),
+                                             summary["room_prices"].tolist()):
+            if room_type not in merged:
+                merged[room_type] = dict(histories.get(room_type, {}))
+            # copies the room's history before adding to it, since the API may be reading the old one
+            history = list(merged[room_type].get(room_id, ()))
+            bisect.insort(history, (date, price))
+            merged[room_type][room_id] = history
+        return merged
+
+    @staticmethod
+    def rank_movers(histories):
+        """
+        This function ranks every room of each room type by how much its price moved, both ways top_movers can, so
+        the API answers /movers by taking the first k instead of going through every history on each request. Like
+        merge_histories, this can run in a thread.
+
+        :param histories: the room price histories of some room types, from merge_histories (dict)
+        :return: a dictionary mapping each room type (str) to a dictionary mapping "total" and "period" to the list
+        of its rooms from top_movers, largest move first (dict)
+        """
+        ranked = {}
+        for room_type, room_histories in histories.items():
+            d = {room_id: [price for date, price in history] for room_id, history in room_histories.items()}
+            ranked[room_type] = {by: visualizer.top_movers(d, max(len(d), 1), by) for by in ("total", "period")}
+        return ranked
+
+    def ingest(self, summary, histories=None, movers=None):
+        """
+        This function adds the results of one snapshot from summarize_snapshot. A snapshot older than ones already
+        ingested is put in its place by date.
+
+        :param summary: the summary of the snapshot (dict)
+        :param histories: the room price histories from merge_histories, which are merged here when None (dict)
+        :param movers: the rankings of rank_movers for those histories, which are ranked here when None (dict)
+        """
+        if histories is None:
+            histories = self.merge_histories(summary)
+        if movers is None:
+            movers = self.rank_movers(histories)
+        state = self._city(summary["city"])
+        date = summary["date"]
+        if date in state["correlations"]:
+            return
+        bisect.insort(state["dates"], date)
+
+        # ranks only the new snapshot's rows
+        correlations, pvalues = visualizer.spearman_batch([(summary["prices"], summary["ratings"])])
+        state["correlations"][date] = (float(correlations[0]), float(pvalues[0]))
+        state["sizes"][date] = len(summary["prices"])
+        state["hosts"][date] = summary["hosts"]
+        state["neighborhoods"][date] = summary["neighborhoods"]
+        # swaps in the histories with the new prices, and their rankings
+        state["histories"].update(histories)
+        state["movers"].update(movers)
+
+    def city_names(self):
+        """
+        :return: a dictionary mapping each city (str) to the dates of its snapshots (list)
+        """
+        return {city: state["dates"] for city, state in sorted(self.cities.items())}
+
+    def correlation(self, city):
+        """
+        This function reports the correlation of every snapshot of a city and the rolling correlation of its last
+        window snapshots, combined like RollingCorrelation does.
+
+        :param city: a city (str)
+        :return: a dictionary with the "snapshots" list and the "rolling" value (dict)
+        """
+        state = self.cities[city]
+        snapshots = [{"date": date, "correlation": state["correlations"][date][0],
+                      "pvalue": state["correlations"][date][1], "listings": state["sizes"][date]}
+                     for date in state["dates"]]
+        recent = snapshots[-self.window:]
+        rolling = visualizer.combine_correlations([snapshot["correlation"] for snapshot in recent],
+                                                  [snapshot["listings"] for snapshot in recent])
+        return {"snapshots": snapshots, "rolling": rolling}
+
+    def hosts(self, city, date=None):
+        """
+        :param city: a city (str)
+        :param date: the date of a snapshot, the latest when None (str)
+        :return: a list where l[i] is the number of hosts with i listings (list)
+        """
+        state = self.cities[city]
+        return state["hosts"][date or state["dates"][-1]]
+
+    def neighborhoods(self, city, date=None, room_type="Entire home/apt"):
+        """
+        :param city: a city (str)
+        :param date: the date of a snapshot, the latest when None (str)
+        :param room_type: a room type (str)
+        :return: a dictionary mapping neighborhoods (str) to dictionaries of price statistics (dict)
+        """
+        state = self.cities[city]
+        stats = state["neighborhoods"][date or state["dates"][-1]]
+        return {neighborhood: value for (kind, neighborhood), value in stats.items() if kind == room_type}
+
+    def prices(self, city, room_id):
+        """
+        :param city: a city (str)
+        :param room_id: a room id (int)
+        :return: a list of the room's dates and prices, whatever its room type was on each date (list)
+        """
+        history = []
+        for histories in self.cities[city]["histories"].values():
+            history.extend(histories.get(room_id, []))
+        return [{"date": date, "price": price} for date, price in sorted(history)]
+
+    def movers(self, city, room_type="Shared room", k=100, by="total"):
+        """
+        This function reads the k largest moves off the ranking rank_movers made when the city's last snapshot of
+        the room type was ingested.
+
+        :param city: a city (str)
+        :param room_type: a room type (str)
+        :param k: the number of rooms to return (int)
+        :param by: "total" or "period", as in top_movers (str)
+        :return: a list of dictionaries with the room id, percent change, starting price and ending price (list)
+        """
+        if k < 1:
+            raise ValueError("k must be at least 1, not %r" % (k,))
+        if by not in ("total", "period"):
+            raise ValueError("by must be \"total\" or \"period\", not %r" % (by,))
+        ranked = self.cities[city]["movers"].get(room_type, {}).get(by, [])
+        return [{"room_id": room_id, "percent_change": percent, "starting": starting, "ending": ending}
+                for room_id, percent, starting, ending in ranked[:k]]
+
+    def query(self, path, params):
+        """
+        This function answers one request of the API.
+
+        :param path: the path of the request, such as "/hosts" (str)
+        :param params: the query parameters, each mapped to its first value (dict)
+        :return: the answer (object)
+        """
+        if path == "/cities":
+            return self.city_names()
+        if path not in ("/correlation", "/hosts", "/neighborhoods", "/prices", "/movers"):
+            raise KeyError(path)
+        city = params["city"]
+        if path == "/correlation":
+            return self.correlation(city)
+        if path == "/hosts":
+            return self.hosts(city, params.get("date"))
+        if path == "/neighborhoods":
+            return self.neighborhoods(city, params.get("date"), params.get("room_type", "Entire home/apt"))
+        if path == "/prices":
+            return self.prices(city, int(params["room_id"]))
+        return self.movers(city, params.get("room_type", "Shared room"), int(params.get("k", 100)),
+                           params.get("by", "total"))
+
+
+def _plain(value):
+    """
+    This function makes a result safe for JSON by turning nan and infinity into None.
+
+    :param value: a result (object)
+    :return: the same result with every non-finite float replaced (object)
+    """
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {str(key): _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def find_new_snapshots(folder, seen, sizes):
+    """
+    This function lists the snapshots in a folder that haven't been ingested yet. A file is only listed once its size
+    and modification time are the same as on the previous look, so files that are still being copied are left for
+    later.
+
+    :param folder: the folder to look in (str)
+    :param seen: the file names already ingested (set)
+    :param sizes: the size and modification time of each file on the previous look, updated in place (dict)
+    :return: the file names of the new snapshots, oldest date first (list)
+    """
+    ready = []
+    for entry in os.scandir(folder):
+        if not entry.name.endswith(".csv") or "_" not in entry.name or entry.path in seen:
+            continue
+        stat = entry.stat()
+        version = (stat.st_size, stat.st_mtime_ns)
+        if sizes.get(entry.path) == version:
+            ready.append(entry.path)
+        sizes[entry.path] = version
+    return sorted(ready, key=visualizer.snapshot_date)
+
+
+async def watch(folder, state, interval=5.0, processes=None):
+    """
+    This function looks for new snapshots every interval seconds and ingests each one as it becomes ready. Files are
+    read in a process pool, and their prices are merged into the room histories and ranked for /movers in a thread,
+    so the API keeps answering while they are parsed and merged. A file that fails to parse is reported and not tried
+    again.
+
+    :param folder: the folder to watch (str)
+    :param state: the results to add to (IngestState)
+    :param interval: the seconds between looks at the folder (float)
+    :param processes: the number of worker processes, one per CPU when None (int)
+    """
+    loop = asyncio.get_running_loop()
+    seen = set()
+    sizes = {}
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as pool:
+        while True:
+            filenames = await loop.run_in_executor(None, find_new_snapshots, folder, seen, sizes)
+            seen.update(filenames)
+            tasks = [loop.run_in_executor(pool, visualizer.run_task, summarize_snapshot, filename) for filename in filenames]
+            for filename, result in zip(filenames, await asyncio.gather(*tasks, return_exceptions=True)):
+                if isinstance(result, Exception):
+                    print("could not ingest %s: %s" % (filename, result), file=sys.stderr)
+                else:
+                    histories = await loop.run_in_executor(None, state.merge_histories, result)
+                    movers = await loop.run_in_executor(None, state.rank_movers, histories)
+                    state.ingest(result, histories, movers)
+                    print("ingested %s" % filename, file=sys.stderr)
+            await asyncio.sleep(interval)
+
+
+async def _handle(state, reader, writer):
+    """
+    This function answers one HTTP request with the JSON result of IngestState.query.
+
+    :param state: the results to query (IngestState)
+    :param reader: the stream of the request (asyncio.StreamReader)
+    :param writer: the stream of the response (asyncio.StreamWriter)
+    """
+    try:
+        request = (await reader.readline()).decode("latin-1").split()
+        # reads and ignores the headers of the request
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        if len(request) < 2 or request[0] != "GET":
+            status, body = "405 Method Not Allowed", {"error": "only GET is supported"}
+        else:
+            url = urlsplit(request[1])
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                status, body = "200 OK", state.query(url.path, params)
+            except KeyError as error:
+                status, body = "404 Not Found", {"error": "unknown %s" % error}
+            except ValueError as error:
+                status, body = "400 Bad Request", {"error": str(error)}
+        data = json.dumps(_plain(body)).encode("utf-8")
+        writer.write(("HTTP/1.0 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                      % (status, len(data))).encode("latin-1") + data)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(folder, host="127.0.0.1", port=8765, interval=5.0, processes=None, window=3):
+    """
+    This function runs the watcher and the API together until it is stopped.
+
+    :param folder: the folder to watch (str)
+    :param host: the address the API listens on (str)
+    :param port: the port the API listens on (int)
+    :param interval: the seconds between looks at the folder (float)
+    :param processes: the number of worker processes, one per CPU when None (int)
+    :param window: the number of snapshots the rolling correlation covers (int)
+    """
+    state = IngestState(window)
+    server = await asyncio.start_server(lambda reader, writer: _handle(state, reader, writer), host, port)
+    print("serving on http://%s:%d" % (host, port), file=sys.stderr)
+    async with server:
+        await asyncio.gather(server.serve_forever(), watch(folder, state, interval, processes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest new Airbnb snapshots and serve the results.")
+    parser.add_argument("folder", help="folder the <city>_<date>.csv snapshots land in")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between looks at the folder")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--window", type=int, default=3, help="snapshots in the rolling correlation")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.folder, args.host, args.port, args.interval, args.processes, args.window))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
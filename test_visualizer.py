@@ -0,0 +1,265 @@
+"""
+Regression tests for visualizer.py.
+
+    python -m pytest test_visualizer.py
+"""
+
+import csv
+import io
+import os
+import warnings
+
+import numpy as np
+import pytest
+from scipy.stats import spearmanr
+
+import visualizer
+
+HEADER = "room_id,host_id,room_type,neighborhood,reviews,overall_satisfaction,price\n"
+
+
+def good_rows(count, start=100):
+    """
+    :param count: the number of rows (int)
+    :param start: the room id of the first row (int)
+    :return: the text of count well-formed rows (str)
+    """
+    return "".join("%d,%d,Private room,Soho,3,4.5,%d\n" % (start + i, start + i, 50 + i) for i in range(count))
+
+
+def read(tmp_path, monkeypatch, text, block_chars=visualizer.BLOCK_CHARS):
+    """
+    This function writes text as a snapshot and reads it back with iter_snapshot_chunks.
+
+    :param tmp_path: the folder to write the snapshot to (Path)
+    :param monkeypatch: the pytest fixture used to change BLOCK_CHARS (MonkeyPatch)
+    :param text: the text of the snapshot after its header (str)
+    :param block_chars: the number of characters the tokenizer reads at a time (int)
+    :return: a tuple of the snapshot's columns (dict) and its number of malformed rows (int)
+    """
+    filename = str(tmp_path / "test_2015-01-01.csv")
+    with open(filename, "w", newline="") as file_out:
+        file_out.write(HEADER + text)
+    monkeypatch.setattr(visualizer, "BLOCK_CHARS", block_chars)
+    # hides the warning about malformed rows, which the tests check through malformed_rows
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        chunks = list(visualizer.iter_snapshot_chunks(filename))
+    columns = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in visualizer.SNAPSHOT_COLUMNS}
+    return (columns, visualizer.malformed_rows[filename])
+
+
+@pytest.mark.parametrize("block_chars", [visualizer.BLOCK_CHARS, 7, 64])
+def test_quoted_fields(tmp_path, monkeypatch, block_chars):
+    text = ('1,1,"Entire home/apt","Back Bay, Boston",2,4.0,120\n'
+            '2,1,Shared room,"The ""Old"" Town",0,,80\n'
+            '3,2,Private room,"North\nEnd",5,5.0,99\n') + good_rows(20)
+    columns, malformed = read(tmp_path, monkeypatch, text, block_chars)
+    assert malformed == 0
+    assert columns["neighborhood"][:3].tolist() == ["Back Bay, Boston", 'The "Old" Town', "North\nEnd"]
+    assert columns["room_id"].tolist() == [1, 2, 3] + list(range(100, 120))
+    assert np.isnan(columns["overall_satisfaction"][1])
+
+
+@pytest.mark.parametrize("block_chars", [visualizer.BLOCK_CHARS, 7, 64])
+def test_quoted_line_break_between_plain_lines(tmp_path, monkeypatch, block_chars):
+    # the middle line of the quoted field has no quote, but isn't the start of a record
+    text = good_rows(5) + '3,2,Private room,"North\n4,4,Mid\nEnd",5,5.0,99\n' + good_rows(5, start=200)
+    columns, malformed = read(tmp_path, monkeypatch, text, block_chars)
+    assert malformed == 0
+    assert columns["room_id"].tolist() == [100, 101, 102, 103, 104, 3, 200, 201, 202, 203, 204]
+    assert columns["neighborhood"][5] == "North\n4,4,Mid\nEnd"
+
+
+@pytest.mark.parametrize("block_chars", [visualizer.BLOCK_CHARS, 7, 64])
+def test_stray_quote_matches_csv_module(tmp_path, monkeypatch, block_chars):
+    text = good_rows(5) + '7,7,Private room,12" Ave,1,3.5,70\n' + good_rows(15, start=200)
+    columns, malformed = read(tmp_path, monkeypatch, text, block_chars)
+    expected = list(csv.reader(io.StringIO(text)))
+    assert malformed == 0
+    assert columns["neighborhood"].tolist() == [row[3] for row in expected]
+    assert columns["room_id"].tolist() == [int(row[0]) for row in expected]
+
+
+@pytest.mark.parametrize("block_chars", [visualizer.BLOCK_CHARS, 7, 64])
+def test_unterminated_quote_skips_one_row(tmp_path, monkeypatch, block_chars):
+    text = '1,1,Shared room,"Soho,1,4.5,100\n' + good_rows(15)
+    columns, malformed = read(tmp_path, monkeypatch, text, block_chars)
+    assert malformed == 1
+    assert columns["room_id"].tolist() == list(range(100, 115))
+
+
+def test_unterminated_quote_is_carried_a_bounded_number_of_lines(tmp_path, monkeypatch):
+    count = visualizer.MAX_RECORD_LINES * 3
+    text = good_rows(3, start=1) + '9,9,Shared room,"Soho,1,4.5,100\n' + good_rows(count)
+    columns, malformed = read(tmp_path, monkeypatch, text, 64)
+    assert malformed == 1
+    assert columns["room_id"].tolist() == [1, 2, 3] + list(range(100, 100 + count))
+
+
+def test_last_line_without_line_break(tmp_path, monkeypatch):
+    columns, malformed = read(tmp_path, monkeypatch, good_rows(2) + '5,5,Shared room,"A, B",1,4.0,60')
+    assert malformed == 0
+    assert columns["neighborhood"].tolist() == ["Soho", "Soho", "A, B"]
+
+
+def test_integer_columns_are_exact(tmp_path, monkeypatch):
+    text = ("1234567890123456789,1,Private room,Soho,3,4.5,50\n"
+            "1234567890123456788,1,Private room,Soho,,4.5,50\n"
+            "1.7,2,Private room,Soho,3,4.5,50\n"
+            "99999999999999999999,2,Private room,Soho,3,4.5,50\n")
+    columns, malformed = read(tmp_path, monkeypatch, text)
+    assert malformed == 2
+    assert columns["room_id"].tolist() == [1234567890123456789, 1234567890123456788]
+    assert columns["reviews"].tolist() == [3, 0]
+
+
+def test_spearman_batch_matches_scipy():
+    rng = np.random.default_rng(0)
+    # ties in both columns, like prices and half-star ratings
+    tied = (np.round(rng.lognormal(4.5, 0.6, 200)), np.round(rng.uniform(2.5, 5.0, 200) * 2) / 2)
+    # nan rows, which are left out
+    missing = (rng.random(50), rng.random(50))
+    missing[0][[3, 7]] = np.nan
+    missing[1][9] = np.nan
+    samples = [tied, missing, (rng.random(30), rng.random(30)), (np.arange(2.0), np.arange(2.0)),
+               (np.arange(5.0), np.full(5, 4.0)), (np.array([]), np.array([]))]
+    correlations, pvalues = visualizer.spearman_batch(samples)
+
+    for (x, y), rho, pvalue in zip(samples[:3], correlations, pvalues):
+        keep = ~(np.isnan(x) | np.isnan(y))
+        expected = spearmanr(x[keep], y[keep])
+        assert rho == pytest.approx(expected.statistic, abs=1e-12)
+        assert pvalue == pytest.approx(expected.pvalue, rel=1e-9, abs=1e-12)
+    # fewer than three rows, a constant column and an empty sample have no correlation
+    assert np.isnan(correlations[3:]).all()
+    assert np.isnan(pvalues[3:]).all()
+
+
+def test_truncated_cache_is_parsed_again(tmp_path, monkeypatch):
+    filename = str(tmp_path / "test_2015-01-01.csv")
+    with open(filename, "w", newline="") as file_out:
+        file_out.write(HEADER + good_rows(500))
+    monkeypatch.setattr(visualizer, "CACHE_DIR", str(tmp_path / "cache"))
+    expected = visualizer.load_snapshot(filename)
+    visualizer.forget_snapshot(filename)
+    path = visualizer._cache_path(filename)
+    stat = os.stat(filename)
+    key = (stat.st_size, stat.st_mtime_ns)
+    assert visualizer._read_cache(filename, key) is not None
+
+    # cuts off the index and part of the last column
+    size = os.path.getsize(path)
+    with open(path, "r+b") as file_out:
+        file_out.truncate(size - 4500)
+    visualizer.forget_snapshot(filename)
+    assert visualizer._read_cache(filename, key) is None
+    snapshot = visualizer.load_snapshot(filename)
+    visualizer.forget_snapshot(filename)
+    for name in visualizer.SNAPSHOT_COLUMNS:
+        assert snapshot[name].tolist() == expected[name].tolist()
+
+
+def test_memoized_results_are_not_shared(tmp_path, monkeypatch):
+    filename = str(tmp_path / "test_2015-01-01.csv")
+    with open(filename, "w", newline="") as file_out:
+        file_out.write(HEADER + good_rows(50))
+    monkeypatch.setattr(visualizer, "CACHE_DIR", "")
+    monkeypatch.setattr(visualizer, "RESULT_CACHE", visualizer.ResultCache())
+    histogram = visualizer.listings_histogram(filename)
+    histogram.append(99)
+    stats = visualizer.price_by_neighborhood(filename, "Private room")
+    stats["Soho"] = -1.0
+    index = visualizer.host_index(filename)
+    with pytest.raises(ValueError):
+        index["room_ids"][0] = -1
+    visualizer.forget_snapshot(filename)
+
+    assert visualizer.listings_histogram(filename) == histogram[:-1]
+    assert visualizer.price_by_neighborhood(filename, "Private room")["Soho"] == pytest.approx(74.5)
+    assert visualizer.host_index(filename)["room_ids"][0] == 100
+    assert visualizer.RESULT_CACHE.hits == 3
+
+
+def test_result_cache_memory_limit():
+    cache = visualizer.ResultCache(max_memory_bytes=3 * 2 ** 20)
+    for key in "abcd":
+        cache.put(key, np.zeros(2 ** 17))
+    # each array takes 1 MB, so only the three most recent fit
+    assert list(cache.entries) == ["b", "c", "d"]
+    cache.put("large", np.zeros(2 ** 20))
+    assert "large" not in cache.entries
+    assert cache.memory_bytes == sum(cache.sizes.values())
+
+
+def write_snapshots(folder, rooms=400, seed=0):
+    """
+    This function writes random snapshots of two cities on three dates, where rooms come and go, hosts have many
+    listings and prices move.
+
+    :param folder: the folder to write the snapshots to (Path)
+    :param rooms: the number of rooms of each city (int)
+    :param seed: the seed of the random numbers (int)
+    :return: the file names of the snapshots (list)
+    """
+    rng = np.random.default_rng(seed)
+    filenames = []
+    for city in ("boston", "nyc"):
+        room_ids = np.arange(1, rooms + 1) * 11 + (0 if city == "boston" else 7)
+        host_ids = rng.zipf(1.6, rooms)
+        room_types = rng.choice(["Entire home/apt", "Private room", "Shared room"], rooms)
+        neighborhoods = rng.choice(["Soho", "Back Bay", "North End", "Chelsea"], rooms)
+        prices = rng.uniform(40, 400, rooms)
+        for month in (1, 2, 3):
+            filename = str(folder / ("%s_2015-%02d-01.csv" % (city, month)))
+            with open(filename, "w", newline="") as file_out:
+                file_out.write(HEADER)
+                for i in np.flatnonzero(rng.random(rooms) < 0.9).tolist():
+                    file_out.write("%d,%d,%s,%s,%d,%.1f,%r\n" % (room_ids[i], host_ids[i], room_types[i],
+                                                                 neighborhoods[i], rng.poisson(3), 4.5, float(prices[i])))
+            prices = prices * rng.uniform(0.7, 1.4, rooms)
+            filenames.append(filename)
+    return filenames
+
+
+@pytest.fixture
+def snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(visualizer, "CACHE_DIR", "")
+    monkeypatch.setattr(visualizer, "RESULT_CACHE", visualizer.ResultCache(max_entries=0))
+    folder = tmp_path / "snapshots"
+    folder.mkdir()
+    return write_snapshots(folder)
+
+
+# small enough that the rows of the snapshots are split over several shards
+SHARD_MEMORY_MB = 0.05
+
+
+def test_sharded_top_movers_matches_room_prices(tmp_path, snapshots):
+    manifest = visualizer.shard_snapshots(snapshots, str(tmp_path / "shards"), memory_mb=SHARD_MEMORY_MB)
+    assert manifest["shards"] > 1
+    for by in ("total", "period"):
+        expected = visualizer.top_movers(visualizer.room_prices(snapshots, "Private room"), 25, by)
+        assert visualizer.sharded_top_movers(manifest, "Private room", 25, by) == expected
+
+
+def test_sharded_listings_histograms_match_listings_histogram(tmp_path, snapshots):
+    manifest = visualizer.shard_snapshots(snapshots, str(tmp_path / "shards"), key="host_id",
+                                          memory_mb=SHARD_MEMORY_MB)
+    assert manifest["shards"] > 1
+    expected = {(visualizer.snapshot_city(filename), visualizer.snapshot_date(filename)):
+                visualizer.listings_histogram(filename) for filename in snapshots}
+    assert visualizer.sharded_listings_histograms(manifest) == expected
+
+
+def test_sharded_neighborhood_stats_match_neighborhood_price_stats(tmp_path, snapshots):
+    manifest = visualizer.shard_snapshots(snapshots, str(tmp_path / "shards"), memory_mb=SHARD_MEMORY_MB)
+    assert manifest["shards"] > 1
+    result = visualizer.sharded_neighborhood_stats(manifest, "Entire home/apt")
+    assert len(result) == len(snapshots)
+    for filename in snapshots:
+        stats = result[(visualizer.snapshot_city(filename), visualizer.snapshot_date(filename))]
+        expected = visualizer.neighborhood_price_stats(filename, "Entire home/apt")
+        assert stats.keys() == expected.keys()
+        for neighborhood, values in expected.items():
+            assert stats[neighborhood] == pytest.approx(values, rel=1e-9)
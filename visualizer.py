@@ -7,10 +7,1133 @@ The goal is to look at the Airbnb
     change over time, and how the prices of listings are different in different neighborhoods.
 """
 
-from scipy.stats.stats import spearmanr
+import argparse
+import atexit
+import bisect
+import csv
+import functools
+import gc
+import glob
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from itertools import chain
+
+import numpy as np
+from scipy.stats import t as t_distribution
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+
+# the columns the analyses read from a snapshot, mapped to the type each column is parsed into
+SNAPSHOT_COLUMNS = {
+    "room_id": np.int64,
+    "host_id": np.int64,
+    "room_type": str,
+    "neighborhood": str,
+    "reviews": np.int64,
+    "overall_satisfaction": np.float64,
+    "price": np.float64,
+}
+
+# the number of rows read from a snapshot at a time when it is streamed
+CHUNK_ROWS = 65536
+
+# the folder binary copies of parsed snapshots are kept in; setting AIRBNB_VIS_CACHE to "" turns the cache off
+CACHE_DIR = os.environ.get("AIRBNB_VIS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "airbnb-vis"))
+
+# the largest total size of the binary copies in CACHE_DIR, in bytes; the least recently used copies are removed
+# past it, and AIRBNB_VIS_CACHE_MB sets it in MB
+CACHE_MAX_BYTES = int(os.environ.get("AIRBNB_VIS_CACHE_MB", "2048")) * 2 ** 20
+
+# the number of characters read from a snapshot file at a time by the tokenizer
+BLOCK_CHARS = 2 ** 20
+
+# the most lines one record may span, through quoted line breaks, before it is counted as malformed; this stops a
+# quote that is never closed from swallowing the rest of the file
+MAX_RECORD_LINES = 64
+
+# the first bytes of a binary snapshot file, which also give the version of the format
+CACHE_MAGIC = b"AIRBNBV2"
+
+# the number of malformed rows skipped in each snapshot file read in this run, keyed by filename
+malformed_rows = {}
+
+# snapshots that have already been parsed in this run, keyed by filename
+_snapshots = {}
+
+# (room_type, neighborhood) indexes that have already been built in this run, keyed by filename
+_indexes = {}
+
+
+# PROFILING
+class Profiler:
+    """
+    This class records how long each instrumented function and stage takes while profiling is on, with the rows and
+    bytes it read and, when memory is True, the peak memory allocated through tracemalloc. Each call or stage is one
+    span; spans that run inside another span are nested under it, and their rows and bytes count for it as well.
+    """
+
+    def __init__(self, memory=False):
+        """
+        :param memory: whether to measure peak allocations, which needs tracemalloc to be running (bool)
+        """
+        self.memory = memory
+        self.spans = []
+        self.stack = []
+        self.origin = time.perf_counter()
+
+    def start(self, name):
+        """
+        This function opens a span inside the span that is open now.
+
+        :param name: the name of the function or stage (str)
+        :return: the new span (dict)
+        """
+        span = {"name": name, "start": time.perf_counter() - self.origin, "seconds": 0.0, "depth": len(self.stack),
+                "rows": 0, "bytes": 0, "peak_bytes": 0, "pid": os.getpid()}
+        if self.memory:
+            # hands the peak so far to the enclosing span before measuring this one from scratch
+            if self.stack:
+                self.stack[-1]["peak_bytes"] = max(self.stack[-1]["peak_bytes"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.stack.append(span)
+        return span
+
+    def stop(self, span):
+        """
+        This function closes a span opened by start and adds what it counted to the enclosing span.
+
+        :param span: the span to close (dict)
+        """
+        span["seconds"] = time.perf_counter() - self.origin - span["start"]
+        if self.memory:
+            span["peak_bytes"] = max(span["peak_bytes"], tracemalloc.get_traced_memory()[1])
+        self.stack.remove(span)
+        if self.stack:
+            parent = self.stack[-1]
+            parent["rows"] += span["rows"]
+            parent["bytes"] += span["bytes"]
+            parent["peak_bytes"] = max(parent["peak_bytes"], span["peak_bytes"])
+        self.spans.append(span)
+
+    def count(self, rows=0, nbytes=0):
+        """
+        This function adds rows and bytes read to the span that is open now.
+
+        :param rows: the number of rows (int)
+        :param nbytes: the number of bytes (int)
+        """
+        if self.stack:
+            self.stack[-1]["rows"] += rows
+            self.stack[-1]["bytes"] += nbytes
+
+    def summary(self):
+        """
+        This function totals the spans by name.
+
+        :return: a dictionary mapping each name (str) to its calls, seconds, rows, bytes and largest peak_bytes (dict)
+        """
+        totals = {}
+        for span in self.spans:
+            total = totals.setdefault(span["name"], {"calls": 0, "seconds": 0.0, "rows": 0, "bytes": 0,
+                                                      "peak_bytes": 0})
+            total["calls"] += 1
+            total["seconds"] += span["seconds"]
+            total["rows"] += span["rows"]
+            total["bytes"] += span["bytes"]
+            total["peak_bytes"] = max(total["peak_bytes"], span["peak_bytes"])
+        return totals
+
+    def write_log(self, filename):
+        """
+        This function writes every span as one line of JSON, in the order the spans finished.
+
+        :param filename: a string that is a file name (str)
+        """
+        with open(filename, "w") as file_out:
+            for span in self.spans:
+                file_out.write(json.dumps(span) + "\n")
+
+    def write_chrome_trace(self, filename):
+        """
+        This function writes the spans in the Chrome trace event format, which chrome://tracing and Perfetto open.
+
+        :param filename: a string that is a file name (str)
+        """
+        events = []
+        for span in self.spans:
+            events.append({"name": span["name"], "ph": "X", "ts": span["start"] * 1e6, "dur": span["seconds"] * 1e6,
+                           "pid": span["pid"], "tid": 0,
+                           "args": {"rows": span["rows"], "bytes": span["bytes"], "peak_bytes": span["peak_bytes"]}})
+        with open(filename, "w") as file_out:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file_out)
+
+# the Profiler that is recording, None when profiling is off
+_profiler = None
+
+@contextmanager
+def profile(memory=False):
+    """
+    This function turns profiling on for the code inside a with block and gives back the Profiler recording it.
+
+        with profile() as profiler:
+            correlation(price_satisfaction(filename))
+        profiler.write_chrome_trace("trace.json")
+
+    :param memory: whether to measure peak allocations with tracemalloc, which slows the code down (bool)
+    :return: yields the Profiler (Profiler)
+    """
+    global _profiler
+    previous = _profiler
+    profiler = Profiler(memory)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _profiler = previous
+        if started:
+            tracemalloc.stop()
+
+@contextmanager
+def _traced_stage(profiler, name):
+    """
+    This function records the code inside a with block as a span of profiler.
+
+    :param profiler: the Profiler recording (Profiler)
+    :param name: the name of the stage (str)
+    """
+    span = profiler.start(name)
+    try:
+        yield span
+    finally:
+        profiler.stop(span)
+
+# the stage used when profiling is off, which does nothing
+_NO_STAGE = nullcontext()
+
+def _stage(name):
+    """
+    This function marks a stage inside a function, such as parsing or rendering, for the profiler.
+
+    :param name: the name of the stage (str)
+    :return: a context manager that records the stage, or does nothing when profiling is off
+    """
+    if _profiler is None:
+        return _NO_STAGE
+    return _traced_stage(_profiler, name)
+
+def _traced_generator(profiler, name, generator):
+    """
+    This function records each step of a generator as a span, so the time spent by the code using the generator
+    between steps isn't counted.
+
+    :param profiler: the Profiler recording (Profiler)
+    :param name: the name of the generator function (str)
+    :param generator: the generator to record (generator)
+    :return: yields what generator yields
+    """
+    while True:
+        span = profiler.start(name)
+        try:
+            item = next(generator)
+        except StopIteration:
+            return
+        finally:
+            profiler.stop(span)
+        yield item
+
+def _instrumented(function):
+    """
+    This function wraps a public function so each call is recorded as a span while profiling is on. When profiling
+    is off the wrapper only checks that it is off and calls the function.
+
+    :param function: the function to wrap (function)
+    :return: the wrapped function (function)
+    """
+    name = function.__name__
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            return _traced_generator(_profiler, name, function(*args, **kwargs))
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return function(*args, **kwargs)
+            span = profiler.start(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.stop(span)
+    return wrapper
+
+def _write_profile(profiler, filename):
+    """
+    This function saves the spans of profiler. A filename ending in ".json" gets a Chrome trace and any other
+    filename gets one line of JSON per span; "{pid}" in the filename is replaced by the process id.
+
+    :param profiler: the Profiler to save (Profiler)
+    :param filename: a string that is a file name (str)
+    """
+    filename = filename.replace("{pid}", str(os.getpid()))
+    if filename.endswith(".json"):
+        profiler.write_chrome_trace(filename)
+    else:
+        profiler.write_log(filename)
+
+def _start_profile():
+    """
+    This function turns profiling on for the whole run of this process, with a new Profiler.
+
+    :return: the Profiler (Profiler)
+    """
+    global _profiler
+    _profiler = Profiler(os.environ.get("AIRBNB_VIS_PROFILE_MEMORY") == "1")
+    if _profiler.memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _profiler
+
+# the file a pool worker saves its profile to after each task, None outside of profiled workers
+_worker_profile = None
+
+def init_worker():
+    """
+    This function sets up a worker process of a process pool. When AIRBNB_VIS_PROFILE is set, the worker gets a
+    Profiler of its own: a forked worker would otherwise keep adding to the copy of its parent's Profiler, and it
+    never runs atexit hooks, so nothing it did was saved. Without "{pid}" in AIRBNB_VIS_PROFILE, each worker saves
+    to the name with ".{pid}" before its extension, so the workers and the parent don't write over each other.
+    """
+    global _worker_profile
+    filename = os.environ.get("AIRBNB_VIS_PROFILE")
+    if not filename:
+        return
+    if "{pid}" not in filename:
+        root, extension = os.path.splitext(filename)
+        filename = root + ".{pid}" + extension
+    _start_profile()
+    _worker_profile = filename
+
+def run_task(function, *args):
+    """
+    This function runs one task in a worker set up by init_worker, and saves the worker's profile once the task is
+    done, since the worker may be stopped without warning after it.
+
+    :param function: the function of the task, which must be picklable (function)
+    :param args: the arguments of function
+    :return: what function returns
+    """
+    try:
+        return function(*args)
+    finally:
+        if _worker_profile is not None and _profiler is not None:
+            _write_profile(_profiler, _worker_profile)
+
+# turns profiling on for the whole run when AIRBNB_VIS_PROFILE names a file to save it to
+if os.environ.get("AIRBNB_VIS_PROFILE"):
+    atexit.register(_write_profile, _start_profile(), os.environ["AIRBNB_VIS_PROFILE"])
+
+
+# RESULT CACHE
+class ResultCache:
+    """
+    This class keeps the results of analyses so repeated calls on the same snapshots skip the parse and the compute.
+    Results are kept in memory for the max_entries most recently used calls, as long as they take no more than
+    max_memory_bytes together, and when folder is given they are also pickled to files in it, removing the least
+    recently used files once they take more than max_bytes.
+    """
+
+    def __init__(self, max_entries=128, folder=None, max_bytes=256 * 2 ** 20, max_memory_bytes=64 * 2 ** 20):
+        """
+        :param max_entries: the number of results kept in memory (int)
+        :param folder: the folder results are also saved to, no saving when None (str)
+        :param max_bytes: the largest total size of the saved results (int)
+        :param max_memory_bytes: the largest total size of the results kept in memory (int)
+        """
+        self.max_entries = max_entries
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.entries = OrderedDict()
+        # the size of each result kept in memory, from _result_size, and their total
+        self.sizes = {}
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        """
+        :param key: the key of a result (str)
+        :return: the file the result is saved to (str)
+        """
+        return os.path.join(self.folder, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pickle")
+
+    def get(self, key):
+        """
+        This function looks a result up in memory, then on disk.
+
+        :param key: the key of the result (str)
+        :return: a tuple of whether the result was found (bool) and the result (tuple)
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return (True, self.entries[key])
+        if self.folder:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as file_in:
+                    stored_key, value = pickle.load(file_in)
+                if stored_key == key:
+                    # marks the file as recently used
+                    os.utime(path)
+                    self._remember(key, value)
+                    self.hits += 1
+                    return (True, value)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+        self.misses += 1
+        return (False, None)
+
+    def put(self, key, value):
+        """
+        This function stores a result in memory, and on disk when there is a folder.
+
+        :param key: the key of the result (str)
+        :param value: the result (object)
+        """
+        self._remember(key, value)
+        if not self.folder:
+            return
+        path = self._path(key)
+        temporary = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(temporary, "wb") as file_out:
+                pickle.dump((key, value), file_out, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+            self._trim()
+        except (OSError, pickle.PicklingError):
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def _remember(self, key, value):
+        """
+        This function stores a result in memory and drops the least recently used ones over max_entries or
+        max_memory_bytes. A result larger than max_memory_bytes on its own isn't kept in memory.
+
+        :param key: the key of the result (str)
+        :param value: the result (object)
+        """
+        size = _result_size(value)
+        if key in self.entries:
+            del self.entries[key]
+            self.memory_bytes -= self.sizes.pop(key)
+        if size > self.max_memory_bytes:
+            return
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.memory_bytes += size
+        while len(self.entries) > self.max_entries or self.memory_bytes > self.max_memory_bytes:
+            old_key, _ = self.entries.popitem(last=False)
+            self.memory_bytes -= self.sizes.pop(old_key)
+
+    def _trim(self):
+        """
+        This function removes the least recently used saved results until they fit in max_bytes.
+        """
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(".pickle"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        """
+        This function forgets every result, in memory and on disk.
+        """
+        self.entries.clear()
+        self.sizes.clear()
+        self.memory_bytes = 0
+        if self.folder and os.path.isdir(self.folder):
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith(".pickle"):
+                    os.remove(entry.path)
+
+def _result_size(value):
+    """
+    This function estimates the memory a result takes, counting arrays by their data and lists, tuples and
+    dictionaries by their items.
+
+    :param value: the result (object)
+    :return: the estimated size in bytes (int)
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_result_size(key) + _result_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_result_size(item) for item in value)
+    return sys.getsizeof(value)
+
+def _result_copy(value):
+    """
+    This function copies a kept result for one caller, so changing it doesn't change what later callers get.
+    Lists and dictionaries are copied, and arrays are given back as read-only views instead of being copied.
+
+    :param value: the result (object)
+    :return: the copy (object)
+    """
+    if isinstance(value, np.ndarray):
+        view = value.view()
+        view.flags.writeable = False
+        return view
+    if isinstance(value, dict):
+        return {key: _result_copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_result_copy(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_result_copy(item) for item in value)
+    return value
+
+# the cache memoized analyses use; AIRBNB_VIS_RESULTS names a folder to also save results to,
+# AIRBNB_VIS_RESULTS_MB caps its size, and AIRBNB_VIS_RESULTS_MEMORY_MB caps the results kept in memory
+RESULT_CACHE = ResultCache(folder=os.environ.get("AIRBNB_VIS_RESULTS") or None,
+                           max_bytes=int(os.environ.get("AIRBNB_VIS_RESULTS_MB", "256")) * 2 ** 20,
+                           max_memory_bytes=int(os.environ.get("AIRBNB_VIS_RESULTS_MEMORY_MB", "64")) * 2 ** 20)
+
+# how a snapshot is recognized in result keys: "mtime" uses its path, size and modification time, and "content"
+# uses a hash of its bytes, so a copied or touched file with the same data keeps its results
+RESULT_KEY = os.environ.get("AIRBNB_VIS_RESULT_KEY", "mtime")
+
+# hashes of snapshot contents, keyed by path, size and modification time so each version is hashed once
+_content_hashes = {}
+
+def _fingerprint(filename):
+    """
+    This function describes the version of a snapshot file for result keys, following RESULT_KEY.
+
+    :param filename: a string that is a file name (str)
+    :return: a description that changes whenever the file changes (str)
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    version = (path, stat.st_size, stat.st_mtime_ns)
+    if RESULT_KEY != "content":
+        return "%s:%d:%d" % version
+    if version not in _content_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file_in:
+            for block in iter(lambda: file_in.read(2 ** 20), b""):
+                digest.update(block)
+        _content_hashes[version] = digest.hexdigest()
+    return _content_hashes[version]
+
+def _memoized(function):
+    """
+    This function wraps an analysis whose first parameter is a file name, or a list of file names, so its results
+    are kept in RESULT_CACHE. The key is the function's name, the version of each file from _fingerprint and the
+    other arguments, so a changed file gets a new result. Every caller gets its own copy from _result_copy. Only
+    analyses with small results are wrapped; keeping intermediates as large as a snapshot would hold on to the
+    memory load_snapshot and forget_snapshot are careful to give back.
+
+    :param function: the function to wrap (function)
+    :return: the wrapped function (function)
+    """
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = list(bound.arguments.items())
+        files = arguments[0][1]
+        if isinstance(files, str):
+            versions = _fingerprint(files)
+        else:
+            versions = [_fingerprint(filename) for filename in files]
+        key = repr((function.__name__, versions, arguments[1:]))
+
+        found, value = RESULT_CACHE.get(key)
+        if not found:
+            value = function(*args, **kwargs)
+            RESULT_CACHE.put(key, value)
+        return _result_copy(value)
+    return wrapper
+
+
+class _LinesRunOut(Exception):
+    """
+    This exception stops the csv reader of _split_quoted when it needs a line after the last one it was given.
+    """
+
+class _RecordTooLong(Exception):
+    """
+    This exception stops the csv reader of _split_quoted when a record spans more than MAX_RECORD_LINES lines.
+    """
+
+def _split_plain(lines):
+    """
+    This function splits lines without any double quote on commas, which is the fast path for snapshot files. The
+    rows hold only strings, so the garbage collector is paused instead of scanning them over and over while they are
+    made.
+
+    :param lines: complete lines of the file, without their line breaks (list)
+    :return: the rows, each row a list of fields (list)
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        # skips blank lines like the csv reader does
+        return [line.rstrip("\r").split(",") for line in lines if line and line != "\r"]
+    finally:
+        if enabled:
+            gc.enable()
+
+def _split_quoted(lines, final):
+    """
+    This function splits lines that may hold quoted fields into rows. A record that starts on a line without a
+    double quote is split with _split_plain, and only the records that start on a line with one go through a csv
+    reader, which knows where each record ends even when a quoted field has commas, doubled quotes or line breaks in
+    it, and reads a quote in the middle of an unquoted field as text. A record that can't be read, because its quote
+    is never closed, it spans more than MAX_RECORD_LINES lines or the csv module rejects it, is counted as malformed,
+    and reading starts again on the line after its first one. The garbage collector is paused like in _split_plain.
+
+    :param lines: complete lines of the file, without their line breaks (list)
+    :param final: whether the lines run to the end of the file (bool)
+    :return: a tuple of the rows (list), the number of malformed records (int) and the lines of a record that goes
+    on past the last line, to be read again with the next lines (list)
+    """
+    rows = []
+    malformed = 0
+    # the lines with a double quote, in order
+    quoted = [i for i, line in enumerate(lines) if '"' in line]
+    # the first line of the record being read, and the next line to hand to the reader
+    start = 0
+    position = 0
+
+    def feed():
+        nonlocal position
+        while position < len(lines):
+            if position - start >= MAX_RECORD_LINES:
+                raise _RecordTooLong()
+            position += 1
+            yield lines[position - 1] + "\n"
+        raise _LinesRunOut()
+
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while start < len(lines):
+            # splits the lines up to the next line with a quote on commas
+            if '"' not in lines[start]:
+                stop = quoted[bisect.bisect_left(quoted, start)] if quoted and quoted[-1] > start else len(lines)
+                rows.extend(_split_plain(lines[start:stop]))
+                start = stop
+                continue
+            position = start
+            try:
+                for row in csv.reader(feed()):
+                    start = position
+                    if row:
+                        rows.append(row)
+                    # goes back to the fast path once a record starts on a line without a quote
+                    if start < len(lines) and '"' not in lines[start]:
+                        break
+            except _LinesRunOut:
+                # the lines ran out between two records
+                if start == len(lines):
+                    break
+                # the lines ran out inside a record, which the next lines may finish
+                if not final:
+                    return (rows, malformed, lines[start:])
+                malformed += 1
+                start += 1
+            except (_RecordTooLong, csv.Error):
+                malformed += 1
+                start += 1
+    finally:
+        if enabled:
+            gc.enable()
+    return (rows, malformed, [])
+
+def _iter_rows(file_in, block_chars):
+    """
+    This function is a generator that splits a CSV file into rows of fields, following RFC 4180. The file is read
+    in blocks of block_chars characters and cut after the last line break of each block. A block without any double
+    quote is split with _split_plain, and a block with quotes goes through _split_quoted, which still splits the
+    records that start on a line without a quote the fast way. Only the lines of a quoted record that is cut by the
+    end of a block are carried to the next block, and there are never more than MAX_RECORD_LINES of them.
+
+    :param file_in: a file opened for reading, after its header line (file)
+    :param block_chars: the number of characters to read at a time (int)
+    :return: yields tuples of the rows of a block, each row a list of fields (list), and the number of malformed
+    records in it (int)
+    """
+    # the start of the line cut by the end of the last block, and the lines of an unfinished quoted record
+    parts = []
+    carried = []
+    while True:
+        block = file_in.read(block_chars)
+        if _profiler is not None:
+            _profiler.count(nbytes=len(block))
+        if not block:
+            break
+        cut = block.rfind("\n")
+        if cut == -1:
+            parts.append(block)
+            continue
+        parts.append(block[:cut])
+        text = "".join(parts)
+        parts = [block[cut + 1:]]
+        lines = text.split("\n")
+
+        if not carried and '"' not in text:
+            yield (_split_plain(lines), 0)
+            continue
+
+        rows, malformed, carried = _split_quoted(carried + lines, False)
+        yield (rows, malformed)
+
+    # the last line when the file doesn't end with a line break, and a record still open at the end of the file
+    last = "".join(parts)
+    lines = carried + ([last] if last.strip("\r") else [])
+    if lines:
+        rows, malformed, _ = _split_quoted(lines, True)
+        yield (rows, malformed)
+
+def _column_array(cells, kind):
+    """
+    This function converts the text of a column into an array of the column's type in one call. Integer columns are
+    read as integers, so ids above 2 ** 53 keep every digit and a cell such as "1.7" isn't a number. Empty cells
+    become 0 in integer columns and nan in float columns.
+
+    :param cells: the text of each cell (list)
+    :param kind: the type of the column (type)
+    :return: a tuple of the array (array) and a boolean array marking the cells that aren't numbers (array), (tuple)
+    """
+    if kind is str:
+        return (np.array(cells, dtype=object), np.zeros(len(cells), dtype=bool))
+    bad = np.zeros(len(cells), dtype=bool)
+    if kind is np.int64:
+        try:
+            return (np.array(cells, dtype=np.int64), bad)
+        except (ValueError, OverflowError):
+            # reads the cells one at a time when some of them are empty or aren't whole numbers
+            values = np.zeros(len(cells), dtype=np.int64)
+            for i, cell in enumerate(cells):
+                if cell == "":
+                    continue
+                try:
+                    values[i] = int(cell)
+                except (ValueError, OverflowError):
+                    bad[i] = True
+            return (values, bad)
+    try:
+        values = np.array(cells, dtype=np.float64)
+    except ValueError:
+        # reads empty cells as nan, then finds the cells that aren't numbers one at a time if there still are some
+        cells = ["nan" if cell == "" else cell for cell in cells]
+        try:
+            values = np.array(cells, dtype=np.float64)
+        except ValueError:
+            values = np.empty(len(cells), dtype=np.float64)
+            for i, cell in enumerate(cells):
+                try:
+                    values[i] = float(cell)
+                except ValueError:
+                    bad[i] = True
+                    values[i] = np.nan
+    return (values, bad)
+
+def _rows_to_chunk(rows, width, columns, positions):
+    """
+    This function turns rows of fields into a chunk of column arrays. Rows that don't have width fields, or have
+    text where a number belongs, are malformed and left out.
+
+    :param rows: the rows of fields (list)
+    :param width: the number of fields in the header (int)
+    :param columns: the names of the columns to keep (list)
+    :param positions: the position and type of each column to keep (list)
+    :return: a tuple of the chunk (dict) and the number of malformed rows (int), (tuple)
+    """
+    good = [row for row in rows if len(row) == width]
+    malformed = len(rows) - len(good)
+
+    chunk = {}
+    bad = np.zeros(len(good), dtype=bool)
+    for name, (position, kind) in zip(columns, positions):
+        chunk[name], column_bad = _column_array([row[position] for row in good], kind)
+        bad |= column_bad
+    if bad.any():
+        malformed += int(bad.sum())
+        chunk = {name: column[~bad] for name, column in chunk.items()}
+    return (chunk, malformed)
+
+
+@_instrumented
+def iter_snapshot_chunks(filename, columns=None, chunk_rows=None):
+    """
+    This function is a generator that reads a snapshot file a fixed number of rows at a time. The header is looked up
+    a single time to find where each column is, and the file is split into fields by _iter_rows, so quoted fields
+    with commas in them stay in their column. Each chunk is given back as a dictionary of arrays, so only one chunk
+    of the file is held in memory at a time. Malformed rows are skipped and counted in malformed_rows, with a
+    warning once the file is done.
+
+    :param filename: a string that is a file name (str)
+    :param columns: the names of the columns to read, all of SNAPSHOT_COLUMNS when None (list)
+    :param chunk_rows: the largest number of rows in one chunk, CHUNK_ROWS when None (int)
+    :return: yields dictionaries mapping each column name (str) to an array of that column's values in the chunk (dict)
+    """
+    if columns is None:
+        columns = list(SNAPSHOT_COLUMNS)
+    if chunk_rows is None:
+        chunk_rows = CHUNK_ROWS
+
+    with open(filename, "r", newline="") as file_in:
+        # finds the position of every requested column in the first line of the file
+        header = next(csv.reader([file_in.readline().lstrip("\ufeff")]), [])
+        header = [name.strip() for name in header]
+        missing = [name for name in columns if name not in header]
+        if missing:
+            raise ValueError("%s is missing the column(s) %s" % (filename, ", ".join(missing)))
+        positions = [(header.index(name), SNAPSHOT_COLUMNS[name]) for name in columns]
+
+        malformed = 0
+        pieces = {name: [] for name in columns}
+        buffered = 0
+        for rows, broken in _iter_rows(file_in, BLOCK_CHARS):
+            # turns each block into column arrays right away so its rows can be freed
+            block, skipped = _rows_to_chunk(rows, len(header), columns, positions)
+            malformed += broken + skipped
+            for name in columns:
+                pieces[name].append(block[name])
+            buffered += len(block[columns[0]]) if columns else 0
+
+            # hands out full chunks as soon as there are enough rows, as slices of one merged array per column,
+            # and keeps the rows after the last full chunk for the next block
+            if buffered >= chunk_rows and buffered > 0:
+                merged = {name: np.concatenate(pieces[name]) for name in columns}
+                offset = 0
+                while buffered - offset >= chunk_rows:
+                    if _profiler is not None:
+                        _profiler.count(rows=chunk_rows)
+                    yield {name: merged[name][offset:offset + chunk_rows] for name in columns}
+                    offset += chunk_rows
+                pieces = {name: [merged[name][offset:]] for name in columns}
+                buffered -= offset
+        if buffered:
+            if _profiler is not None:
+                _profiler.count(rows=buffered)
+            yield {name: np.concatenate(pieces[name]) for name in columns}
+
+    malformed_rows[filename] = malformed
+    if malformed:
+        warnings.warn("skipped %d malformed row(s) in %s" % (malformed, filename))
+
+
+@_instrumented
+def load_snapshot(filename):
+    """
+    This function reads a whole snapshot file and returns its columns as arrays. A snapshot that was already loaded in
+    this run is returned again without reading the file as long as the file has not changed.
+
+    :param filename: a string that is a file name (str)
+    :return: a dictionary mapping each name in SNAPSHOT_COLUMNS (str) to an array of that column's values (dict)
+    """
+    stat = os.stat(filename)
+    key = (stat.st_size, stat.st_mtime_ns)
+    cached = _snapshots.get(filename)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    # uses the binary copy of the snapshot when there is one for this version of the file
+    with _stage("read cache"):
+        snapshot = _read_cache(filename, key)
+    if snapshot is None:
+        with _stage("parse"):
+            chunks = list(iter_snapshot_chunks(filename))
+            snapshot = {}
+            for name, kind in SNAPSHOT_COLUMNS.items():
+                if chunks:
+                    snapshot[name] = np.concatenate([chunk[name] for chunk in chunks])
+                else:
+                    snapshot[name] = np.array([], dtype=object if kind is str else kind)
+        with _stage("write cache"):
+            index = _write_cache(filename, key, snapshot)
+        # keeps the index the cache file was written with, so snapshot_index doesn't build it again
+        if index is not None:
+            _indexes[filename] = (snapshot, index)
+    _snapshots[filename] = (key, snapshot)
+    return snapshot
+
+def forget_snapshot(filename):
+    """
+    This function drops a snapshot loaded by load_snapshot, and its index, so a long-running process that reads
+    many snapshots doesn't keep all of them. Loading it again reads the file, or its binary copy, again.
+
+    :param filename: a string that is a file name (str)
+    """
+    _snapshots.pop(filename, None)
+    _indexes.pop(filename, None)
+
+def _cache_path(filename):
+    """
+    This function names the binary copy of a snapshot after a hash of the snapshot's full path.
+
+    :param filename: a string that is a file name (str)
+    :return: the path of the binary copy, None when the cache is turned off (str)
+    """
+    if not CACHE_DIR:
+        return None
+    digest = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, digest + ".snapshot")
+
+def _write_cache(filename, key, snapshot):
+    """
+    This function saves a parsed snapshot as a binary file. The file is CACHE_MAGIC, the length of a JSON header, the
+    header, and then every column as fixed-width values starting on a 64 byte boundary. Room types and neighborhoods
+    are stored as int32 codes into a list of their distinct values kept in the header. The (room_type, neighborhood)
+    index of snapshot_index is built from those codes and saved after the columns, so it is read back with the
+    snapshot. The file is written next to its final name and renamed, so a reader never sees half of it. Failing to
+    write the cache is not an error.
+
+    :param filename: a string that is a file name (str)
+    :param key: the size and modification time of the file (tuple)
+    :param snapshot: the parsed snapshot (dict)
+    :return: the index of the snapshot, None when the cache is turned off (dict)
+    """
+    path = _cache_path(filename)
+    if path is None:
+        return None
+
+    header = {"size": key[0], "mtime_ns": key[1], "rows": len(snapshot["room_id"]), "columns": {}}
+    arrays = []
+    offset = 0
+    codes = {}
+    for name, kind in SNAPSHOT_COLUMNS.items():
+        column = snapshot[name]
+        column_header = {}
+        # replaces strings by their position in the list of distinct strings
+        if kind is str:
+            dictionary, column = np.unique(column, return_inverse=True)
+            column = column.astype(np.int32)
+            column_header["dictionary"] = dictionary.tolist()
+            codes[name] = (dictionary, column)
+        column = np.ascontiguousarray(column)
+        column_header["dtype"] = column.dtype.str
+        column_header["offset"] = offset
+        header["columns"][name] = column_header
+        arrays.append(column)
+        offset += -(-column.nbytes // 64) * 64
+
+    # saves the row order of the index after the columns, and the slice of it each pair has in the header
+    order, groups = _index_order(*codes["room_type"], *codes["neighborhood"])
+    header["index"] = {"offset": offset, "groups": groups}
+    arrays.append(order)
+    offset += -(-order.nbytes // 64) * 64
+
+    encoded = json.dumps(header).encode("utf-8")
+    start = -(-(len(CACHE_MAGIC) + 8 + len(encoded)) // 64) * 64
+    temporary = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(temporary, "wb") as file_out:
+            file_out.write(CACHE_MAGIC)
+            file_out.write(len(encoded).to_bytes(8, "little"))
+            file_out.write(encoded)
+            for name, column in zip(SNAPSHOT_COLUMNS, arrays):
+                file_out.seek(start + header["columns"][name]["offset"])
+                file_out.write(column.tobytes())
+            file_out.seek(start + header["index"]["offset"])
+            file_out.write(order.tobytes())
+            file_out.truncate(start + offset)
+        os.replace(temporary, path)
+        _trim_cache()
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return _index_slices(order, groups)
+
+def _trim_cache():
+    """
+    This function removes the least recently used binary copies in CACHE_DIR until they fit in CACHE_MAX_BYTES, like
+    ResultCache._trim. A copy that is still mapped by another process stays readable by it after it is removed.
+    """
+    files = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith(".snapshot"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+def _read_cache(filename, key):
+    """
+    This function memory-maps the binary copy of a snapshot written by _write_cache. Numeric columns are views of the
+    mapped file, so nothing is copied until they are used; room types and neighborhoods are turned back into strings.
+    The index saved with the snapshot is kept for snapshot_index.
+
+    :param filename: a string that is a file name (str)
+    :param key: the size and modification time the file has now (tuple)
+    :return: the snapshot, or None when there is no complete binary copy for this version of the file (dict)
+    """
+    path = _cache_path(filename)
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(buffer[:len(CACHE_MAGIC)]) != CACHE_MAGIC:
+            return None
+        length = int.from_bytes(bytes(buffer[len(CACHE_MAGIC):len(CACHE_MAGIC) + 8]), "little")
+        header = json.loads(bytes(buffer[len(CACHE_MAGIC) + 8:len(CACHE_MAGIC) + 8 + length]).decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+    # the copy is out of date when the file has changed since it was written
+    if (header["size"], header["mtime_ns"]) != tuple(key):
+        return None
+    # marks the copy as recently used for _trim_cache
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    start = -(-(len(CACHE_MAGIC) + 8 + length) // 64) * 64
+    rows = header["rows"]
+    # a copy cut short, say by a full disk, would give columns of different lengths, so it is parsed again instead
+    spans = [(column_header["offset"], np.dtype(column_header["dtype"]).itemsize)
+             for column_header in header["columns"].values()]
+    if "index" in header:
+        spans.append((header["index"]["offset"], 8))
+    if any(start + offset + rows * itemsize > len(buffer) for offset, itemsize in spans):
+        return None
+    snapshot = {}
+    for name, column_header in header["columns"].items():
+        dtype = np.dtype(column_header["dtype"])
+        offset = start + column_header["offset"]
+        column = np.asarray(buffer[offset:offset + rows * dtype.itemsize]).view(dtype)
+        if "dictionary" in column_header:
+            column = np.array(column_header["dictionary"], dtype=object)[column]
+        snapshot[name] = column
+    if "index" in header:
+        offset = start + header["index"]["offset"]
+        order = np.asarray(buffer[offset:offset + rows * 8]).view(np.int64)
+        _indexes[filename] = (snapshot, _index_slices(order, header["index"]["groups"]))
+    if _profiler is not None:
+        _profiler.count(rows, len(buffer))
+    return snapshot
+
+
+def _index_order(room_types, room_type_codes, neighborhoods, neighborhood_codes):
+    """
+    This function orders the rows of a snapshot by one stable sort on their (room type, neighborhood) pair, so the
+    rows of each pair sit next to each other.
+
+    :param room_types: the distinct room types (array)
+    :param room_type_codes: the position of each row's room type in room_types (array)
+    :param neighborhoods: the distinct neighborhoods (array)
+    :param neighborhood_codes: the position of each row's neighborhood in neighborhoods (array)
+    :return: a tuple of the row numbers in that order (array) and a list of the room type, neighborhood, start and
+    stop of each pair's slice of the order (list)
+    """
+    # combines the two codes into one code per row
+    codes = room_type_codes.astype(np.int64) * len(neighborhoods) + neighborhood_codes
+    order = np.argsort(codes, kind="stable").astype(np.int64)
+    counts = np.bincount(codes, minlength=len(room_types) * len(neighborhoods))
+    offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
+
+    groups = []
+    for code in np.flatnonzero(counts).tolist():
+        groups.append([str(room_types[code // len(neighborhoods)]), str(neighborhoods[code % len(neighborhoods)]),
+                       offsets[code], offsets[code + 1]])
+    return (order, groups)
+
+def _index_slices(order, groups):
+    """
+    :param order: the row numbers from _index_order (array)
+    :param groups: the slices from _index_order (list)
+    :return: a dictionary mapping (room type, neighborhood) tuples (tuple) to arrays of row numbers (dict)
+    """
+    return {(room_type, neighborhood): order[start:stop] for room_type, neighborhood, start, stop in groups}
+
+@_instrumented
+def snapshot_index(filename):
+    """
+    This function groups the rows of a snapshot by room type and neighborhood. The rows are ordered by one stable
+    sort on the pair, and each pair is mapped to its slice of that order, so any room type or neighborhood filter
+    is answered by looking up slices instead of scanning the file. The index is kept for the rest of the run like
+    the snapshot it was built from, and is saved in the binary cache, so another run reads it instead of sorting.
+
+    :param filename: a string that is a file name (str)
+    :return: a dictionary mapping (room type, neighborhood) tuples (tuple) to arrays of row numbers (dict)
+    """
+    snapshot = load_snapshot(filename)
+    cached = _indexes.get(filename)
+    if cached is not None and cached[0] is snapshot:
+        return cached[1]
+
+    # numbers the room types and neighborhoods, then sorts the rows by pair
+    room_types, room_type_codes = np.unique(snapshot["room_type"], return_inverse=True)
+    neighborhoods, neighborhood_codes = np.unique(snapshot["neighborhood"], return_inverse=True)
+    index = _index_slices(*_index_order(room_types, room_type_codes, neighborhoods, neighborhood_codes))
+    _indexes[filename] = (snapshot, index)
+    return index
+
+@_instrumented
+def select_rows(filename, room_type=None, neighborhood=None):
+    """
+    This function uses snapshot_index to find the rows of a snapshot with a room type and/or neighborhood.
+
+    :param filename: a string that is a file name (str)
+    :param room_type: the room type to keep, any room type when None (str)
+    :param neighborhood: the neighborhood to keep, any neighborhood when None (str)
+    :return: the row numbers that match, in file order (array)
+    """
+    index = snapshot_index(filename)
+    # looks the pair up directly when both are given
+    if room_type is not None and neighborhood is not None:
+        return index.get((room_type, neighborhood), np.array([], dtype=np.intp))
+
+    matches = [rows for (key_room_type, key_neighborhood), rows in index.items()
+               if room_type in (None, key_room_type) and neighborhood in (None, key_neighborhood)]
+    if not matches:
+        return np.array([], dtype=np.intp)
+    return np.sort(np.concatenate(matches))
+
 
 # PART 1
+@_instrumented
 def price_satisfaction(filename):
     """
     This function takes a string that is a filename as a parameter and returns a list of lists. Each list has two elements,
@@ -19,71 +1142,257 @@ def price_satisfaction(filename):
     :param filename: a string that is a file name (str)
     :return: list of lists, and each list has two floats (list)
     """
-    # opens the file for reading
-    file_in = open(filename, "r")
-    # reads the first line of the file
-    first_line = file_in.readline()
-    # reads every line after the first of the file
-    lines = file_in.readlines()
-    # makes a list from the first line of the file, splitting after each comma
-    first_split = first_line.split(",")
-
-    outer_list = []
-    inner_list = []
-
-    # loops over the words in each line and puts them into a list
-    for words in lines:
-        split = words.split(",")
-
-        # for loop iterates over the number of columns (the number of entries in the first line)
-        for k in range(len(first_split)):
-            # if the number of reviews is greater than 0, runs the rest of the code
-            if first_split[k] == "reviews":
-                if int(split[k]) > 0:
-
-                    for i in range(len(first_split)):
-                        for j in range(len(first_split)):
-
-                            # adds the values in the price column and the overall satisfaction column as a tuple into
-                            # a new list
-                            if first_split[i] == "price":
-                                if first_split[j] == "overall_satisfaction":
-                                    inner_list = [float(split[i]), float(split[j])]
-
-                    # appends the inner list to an outer list and resets the inner list
-                    outer_list.append(inner_list)
-                    inner_list = []
+    price, satisfaction = _rated(load_snapshot(filename))
+
+    # pairs the price and the overall satisfaction of each kept listing into a list
+    outer_list = np.column_stack((price, satisfaction)).tolist()
 
     # returns the outer list
     return outer_list
 
+def _rated(snapshot):
+    """
+    This function keeps the listings of a snapshot that have at least one review, a rating and a price.
+
+    :param snapshot: a snapshot from load_snapshot (dict)
+    :return: a tuple of two float arrays, the prices and the overall satisfactions of those listings (tuple)
+    """
+    price = snapshot["price"]
+    satisfaction = snapshot["overall_satisfaction"]
+    keep = (snapshot["reviews"] > 0) & ~np.isnan(satisfaction) & ~np.isnan(price)
+    return (price[keep], satisfaction[keep])
+
+@_instrumented
+def stream_price_satisfaction(filename, chunk_rows=None):
+    """
+    This function does the same work as price_satisfaction but streams the file instead of loading it. Prices and
+    overall satisfactions are copied chunk by chunk into two float arrays that grow by doubling, so memory stays at
+    one chunk plus the two output columns.
+
+    :param filename: a string that is a file name (str)
+    :param chunk_rows: the largest number of rows read at a time, CHUNK_ROWS when None (int)
+    :return: a tuple of two float arrays, the prices and the overall satisfactions of the listings (tuple)
+    """
+    if chunk_rows is None:
+        chunk_rows = CHUNK_ROWS
+    prices = np.empty(chunk_rows, dtype=np.float64)
+    ratings = np.empty(chunk_rows, dtype=np.float64)
+    size = 0
+
+    for chunk in iter_snapshot_chunks(filename, ["reviews", "overall_satisfaction", "price"], chunk_rows):
+        satisfaction = chunk["overall_satisfaction"]
+        # keeps the listings that have at least one review, a rating and a price
+        keep = (chunk["reviews"] > 0) & ~np.isnan(satisfaction) & ~np.isnan(chunk["price"])
+        count = int(np.count_nonzero(keep))
+
+        # doubles the buffers when the kept rows of this chunk don't fit
+        if size + count > len(prices):
+            capacity = max(2 * len(prices), size + count)
+            prices = np.resize(prices, capacity)
+            ratings = np.resize(ratings, capacity)
+
+        prices[size:size + count] = chunk["price"][keep]
+        ratings[size:size + count] = satisfaction[keep]
+        size += count
+
+    # returns views of the filled part of the buffers
+    return (prices[:size], ratings[:size])
+
+@_instrumented
 def correlation(l):
     """
     This function uses a list of lists that consists of price and overall satisfaction (both floats). It uses a
     Spearman's rank correlation to return the correlation and pvalue between the price and overall satisfaction.
+    A tuple of two arrays from stream_price_satisfaction can be passed instead of the list of lists.
 
-    :param l: a list of lists consisting of floats: price and overall satisfaction (list)
+    :param l: a list of lists consisting of floats: price and overall satisfaction (list), or a tuple of a price
+    array and an overall satisfaction array (tuple)
     :return: a tuple consisting of correlation (float) and overall satisfaction (float), (tuple)
     """
-    price_list = []
-    rating_list = []
-
-    # for loop loops over the number of lists in the list in the parameter
-    for i in range(len(l)):
-        # adds the first element in each sublist to the list of prices
-        price_list.append(l[i][0])
-        # adds the second element in each sublist to the list of ratings
-        rating_list.append(l[i][1])
-    # calls spearmanr to compute the correlation between the list of prices and list of ratings
-    result = spearmanr(price_list, rating_list)
-    correlation = result.correlation
-    pvalue = result.pvalue
-    # sets tuple as a tuple consisting of the correlation and pvalue from spearmanr
+    # takes the first and second column of the list of lists
+    if isinstance(l, list):
+        pairs = np.asarray(l, dtype=np.float64).reshape(-1, 2)
+        price_list = pairs[:, 0]
+        rating_list = pairs[:, 1]
+    # otherwise, uses the price and rating arrays directly
+    else:
+        price_list, rating_list = l
+    # computes the Spearman correlation between the list of prices and list of ratings
+    correlations, pvalues = spearman_batch([(price_list, rating_list)])
+    correlation = correlations[0]
+    pvalue = pvalues[0]
+    # sets tuple as a tuple consisting of the correlation and pvalue
     tuple = (float(correlation), float(pvalue))
     # returns the tuple
     return tuple
 
+@_instrumented
+@_memoized
+def snapshot_correlation(filename):
+    """
+    This function computes correlation(price_satisfaction(filename)) with the streaming reader, and keeps the result
+    so asking again for an unchanged file costs a lookup.
+
+    :param filename: a string that is a file name (str)
+    :return: a tuple consisting of correlation (float) and pvalue (float), (tuple)
+    """
+    return correlation(stream_price_satisfaction(filename))
+
+def _rank_groups(values, groups):
+    """
+    This function ranks values separately inside each group with one sort over all of them. Tied values share the
+    average of the ranks they cover, and ranks start at 1 in every group.
+
+    :param values: the values to rank (array)
+    :param groups: the group number of each value (array)
+    :return: the rank of each value inside its group, in the order the values were given (array)
+    """
+    # sorts by group first and by value inside each group
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    sorted_groups = groups[order]
+    positions = np.arange(len(order))
+
+    # marks where each group starts and where each run of tied values starts
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    new_run = new_group.copy()
+    new_run[1:] |= sorted_values[1:] != sorted_values[:-1]
+
+    # finds the first position of the group and the first and last position of the run each value sits in
+    group_start = np.maximum.accumulate(np.where(new_group, positions, 0))
+    run_id = np.cumsum(new_run) - 1
+    run_first = positions[new_run]
+    run_last = np.append(run_first[1:], len(order)) - 1
+
+    ranks = np.empty(len(order), dtype=np.float64)
+    ranks[order] = (run_first[run_id] + run_last[run_id]) / 2.0 - group_start + 1
+    return ranks
+
+@_instrumented
+def spearman_batch(samples):
+    """
+    This function computes Spearman's rank correlation and its two-sided pvalue for many samples at once. All the
+    samples are ranked together with one sort, and the correlations are summed per sample with bincount, so the work
+    doesn't go through a Python loop per row or per sample. Rows where either value is nan are left out, and samples
+    with fewer than three rows left or a constant column get nan.
+
+    :param samples: a list of tuples, each with a price array and an overall satisfaction array (list)
+    :return: a tuple of two float arrays, the correlation and the pvalue of each sample (tuple)
+    """
+    lengths = np.array([len(sample[0]) for sample in samples], dtype=np.int64)
+    if len(samples) == 0 or lengths.sum() == 0:
+        return (np.full(len(samples), np.nan), np.full(len(samples), np.nan))
+    groups = np.repeat(np.arange(len(samples)), lengths)
+    x = np.concatenate([np.asarray(sample[0], dtype=np.float64) for sample in samples])
+    y = np.concatenate([np.asarray(sample[1], dtype=np.float64) for sample in samples])
+
+    # drops the rows with a missing price or rating, which would otherwise be ranked above every other value
+    keep = ~(np.isnan(x) | np.isnan(y))
+    if not keep.all():
+        groups = groups[keep]
+        x = x[keep]
+        y = y[keep]
+        lengths = np.bincount(groups, minlength=len(samples))
+
+    # ranks prices and ratings inside their own sample
+    with _stage("rank"):
+        x_rank = _rank_groups(x, groups)
+        y_rank = _rank_groups(y, groups)
+
+    # centers the ranks on the mean rank of their sample, which is (n + 1) / 2
+    n = lengths.astype(np.float64)
+    mean_rank = (n + 1) / 2.0
+    x_rank -= mean_rank[groups]
+    y_rank -= mean_rank[groups]
+
+    # the Spearman correlation is the Pearson correlation of the ranks
+    count = len(samples)
+    sxy = np.bincount(groups, x_rank * y_rank, count)
+    sxx = np.bincount(groups, x_rank * x_rank, count)
+    syy = np.bincount(groups, y_rank * y_rank, count)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rho = sxy / np.sqrt(sxx * syy)
+        rho = np.clip(rho, -1.0, 1.0)
+        rho[n < 3] = np.nan
+
+        # tests the correlation with a t distribution with n - 2 degrees of freedom
+        t = rho * np.sqrt((n - 2) / ((1.0 - rho) * (1.0 + rho)))
+        pvalue = 2 * t_distribution.sf(np.abs(t), n - 2)
+    return (rho, pvalue)
+
+class RollingCorrelation:
+    """
+    This class keeps the Spearman correlation of each snapshot added to it, in the order they were added, and a
+    rolling summary over the last few snapshots. Adding a snapshot ranks only that snapshot's rows; the older
+    snapshots keep the correlation they already have.
+    """
+
+    def __init__(self, window=3):
+        """
+        :param window: the number of most recent snapshots the rolling correlation covers (int)
+        """
+        self.window = window
+        self.labels = []
+        self.sizes = []
+        self.correlations = []
+        self.pvalues = []
+
+    def add(self, label, prices, ratings):
+        """
+        This function adds a snapshot and returns its correlation.
+
+        :param label: a name for the snapshot, such as its file name (str)
+        :param prices: the prices of the snapshot's listings (array)
+        :param ratings: the overall satisfactions of the snapshot's listings (array)
+        :return: a tuple consisting of correlation (float) and pvalue (float), (tuple)
+        """
+        return self.add_many([(label, prices, ratings)])[0]
+
+    def add_many(self, snapshots):
+        """
+        This function adds several snapshots with one call to spearman_batch and returns their correlations.
+
+        :param snapshots: a list of tuples, each with a label, a price array and a rating array (list)
+        :return: a list of tuples consisting of correlation (float) and pvalue (float), (list)
+        """
+        correlations, pvalues = spearman_batch([(prices, ratings) for label, prices, ratings in snapshots])
+        for (label, prices, ratings), correlation, pvalue in zip(snapshots, correlations, pvalues):
+            self.labels.append(label)
+            # counts only the rows spearman_batch kept
+            self.sizes.append(int(np.count_nonzero(~(np.isnan(prices) | np.isnan(ratings)))))
+            self.correlations.append(float(correlation))
+            self.pvalues.append(float(pvalue))
+        return list(zip(correlations.tolist(), pvalues.tolist()))
+
+    def rolling(self):
+        """
+        This function combines the correlations of the last window snapshots into one value with
+        combine_correlations.
+
+        :return: the rolling correlation, nan when no snapshot in the window has a correlation (float)
+        """
+        return combine_correlations(self.correlations[-self.window:], self.sizes[-self.window:])
+
+def combine_correlations(correlations, sizes):
+    """
+    This function combines the correlations of several snapshots into one value. The correlations are averaged after
+    Fisher's z transform, weighting each snapshot by its number of rows minus 3.
+
+    :param correlations: the correlation of each snapshot (list)
+    :param sizes: the number of rows of each snapshot (list)
+    :return: the combined correlation, nan when no snapshot has a correlation (float)
+    """
+    rho = np.array(correlations, dtype=np.float64)
+    weights = np.array(sizes, dtype=np.float64) - 3
+    keep = ~np.isnan(rho) & (weights > 0)
+    if not keep.any():
+        return float("nan")
+    z = np.arctanh(np.clip(rho[keep], -0.999999, 0.999999))
+    return float(np.tanh(np.average(z, weights=weights[keep])))
+
 # PART 2
+@_instrumented
 def host_listings(filename):
     """
     This function takes a string that is a file name and uses it to create a dictionary. The dictionary's keys are host ids
@@ -93,34 +1402,73 @@ def host_listings(filename):
     :return: a dictionary with host ids as keys (int) and room ids (int) in a list as values, (dict)
     """
     dict = {}
-    # opens filename to read
-    file_in = open(filename, "r")
-    # reads the first line of the file
-    first_line = file_in.readline()
-    # reads the lines after the first line of the file
-    lines = file_in.readlines()
-    # splits the first line of the file into a list, separating by commas
-    first_split = first_line.split(",")
-    values_list = []
-
-    # loops over the words in each line and puts them into a list
-    for words in lines:
-        split = words.split(",")
-
-        # for loops loop over the elements in the columns containing host id and room id
-        for i in range(len(first_split)):
-            for j in range(len(first_split)):
-                if first_split[i] == "host_id":
-                    if first_split[j] == "room_id":
-
-                        # if host id is already in dictionary, adds additional room ids to the list that is the value
-                        if int(split[i]) in dict.keys():
-                            dict[int(split[i])].append(int(split[j]))
-                        # if the host id isn't already in  dictionary, adds new item with room id (list) as the value
-                        else:
-                            dict[int(split[i])] = [int(split[j])]
+    snapshot = load_snapshot(filename)
+
+    # walks the host id and room id columns side by side
+    for host_id, room_id in zip(snapshot["host_id"].tolist(), snapshot["room_id"].tolist()):
+        # if host id is already in dictionary, adds additional room ids to the list that is the value
+        if host_id in dict:
+            dict[host_id].append(room_id)
+        # if the host id isn't already in  dictionary, adds new item with room id (list) as the value
+        else:
+            dict[host_id] = [room_id]
     return dict
 
+@_instrumented
+@_memoized
+def host_index(filename):
+    """
+    This function builds a compact index from host ids to room ids. It holds three arrays instead of a dictionary of
+    lists: the distinct host ids in increasing order, the offsets where each host's rooms start, and every room id
+    grouped by host. The rooms of host_ids[i] are room_ids[offsets[i]:offsets[i + 1]], in file order.
+
+    :param filename: a string that is a file name (str)
+    :return: a dictionary with the arrays "host_ids", "offsets" and "room_ids" (dict)
+    """
+    snapshot = load_snapshot(filename)
+    # sorts the rows by host, keeping each host's rooms in file order
+    order = np.argsort(snapshot["host_id"], kind="stable")
+    host_ids, counts = np.unique(snapshot["host_id"][order], return_counts=True)
+    offsets = np.zeros(len(host_ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return {"host_ids": host_ids, "offsets": offsets, "room_ids": np.ascontiguousarray(snapshot["room_id"][order])}
+
+@_instrumented
+def host_rooms(index, host_id):
+    """
+    This function looks up the rooms of a host in a host_index with a binary search.
+
+    :param index: an index from host_index (dict)
+    :param host_id: a host id (int)
+    :return: the room ids of the host, empty when the host has none (array)
+    """
+    position = int(np.searchsorted(index["host_ids"], host_id))
+    if position == len(index["host_ids"]) or index["host_ids"][position] != host_id:
+        return index["room_ids"][:0]
+    return index["room_ids"][index["offsets"][position]:index["offsets"][position + 1]]
+
+@_instrumented
+def save_host_index(index, filename):
+    """
+    This function writes a host_index to an uncompressed .npz file.
+
+    :param index: an index from host_index (dict)
+    :param filename: a string that is a file name (str)
+    """
+    np.savez(filename, **index)
+
+@_instrumented
+def load_host_index(filename):
+    """
+    This function reads a host_index written by save_host_index.
+
+    :param filename: a string that is a file name (str)
+    :return: a dictionary with the arrays "host_ids", "offsets" and "room_ids" (dict)
+    """
+    with np.load(filename) as data:
+        return {name: data[name] for name in ("host_ids", "offsets", "room_ids")}
+
+@_instrumented
 def num_listings(d):
     """
     This function takes d, a parameter that's a dictionary consisting of keys that are host ids and values that are lists
@@ -129,271 +1477,498 @@ def num_listings(d):
     :param d: a dictionary of keys that are host ids (int) and values that are lists of room ids (int), (dict)
     :return: a list where where l[i] is the number of hosts with i listings (list)
     """
-    num_list = []
-    frequency_list = []
-    max_listing = 0
-    list_d = list(d)
-    count = 0
-
-    # compares the number of values/listings associated with host ids to identify the greatest number of listings for any one host
-    for i in range(len(d)):
-        if (len(d[list_d[i]]) > max_listing):
-            max_listing = len(d[list_d[i]])
-
-    # counts how many hosts have listings that are equal to i
-    for i in range(max_listing+1):
-        for host in d.keys():
-            # if the number of listings a host has is equal to i, adds one to the count
-            if len(d[host]) == i:
-                count += 1
-        # appends the frequency of hosts with i number of listings to a list
-        num_list.append(count)
-        # resets the count to zero
-        count = 0
+    # counts how many hosts have each number of listings in one pass over the hosts
+    lengths = np.fromiter((len(rooms) for rooms in d.values()), dtype=np.int64, count=len(d))
     # returns a list with the number of hosts with exactly i listings
-    return num_list
+    return np.bincount(lengths, minlength=1).tolist()
+
+@_instrumented
+@_memoized
+def listings_histogram(filename):
+    """
+    This function does the same work as num_listings(host_listings(filename)) straight from the host id column,
+    without building the dictionary of room ids.
+
+    :param filename: a string that is a file name (str)
+    :return: a list where where l[i] is the number of hosts with i listings (list)
+    """
+    # counts the listings of each host, then the hosts with each number of listings
+    per_host = np.unique(load_snapshot(filename)["host_id"], return_counts=True)[1]
+    return np.bincount(per_host, minlength=1).tolist()
+
+class ListingsHistogram:
+    """
+    This class keeps the number of hosts with each number of listings up to date as listings are added and removed,
+    so it can follow new scrape rows without recounting every host. l[i] in counts() matches num_listings.
+    """
+
+    def __init__(self, host_ids=()):
+        """
+        :param host_ids: the host id of each listing to start with (array)
+        """
+        self.per_host = {}
+        self.histogram = np.zeros(1, dtype=np.int64)
+        self.add(host_ids)
+
+    def _update(self, host_ids, sign):
+        """
+        This function moves each host in host_ids from its old number of listings to its new one.
+
+        :param host_ids: the host id of each listing that changes (array)
+        :param sign: 1 to add the listings, -1 to remove them (int)
+        """
+        hosts, changes = np.unique(np.asarray(host_ids, dtype=np.int64), return_counts=True)
+        hosts = hosts.tolist()
+        changes = changes.tolist()
+        # checks every removal before changing anything
+        if sign < 0:
+            for host, change in zip(hosts, changes):
+                if self.per_host.get(host, 0) < change:
+                    raise ValueError("host %d has only %d listing(s) to remove" % (host, self.per_host.get(host, 0)))
+
+        for host, change in zip(hosts, changes):
+            old = self.per_host.get(host, 0)
+            new = old + sign * change
+            # grows the histogram when a host has more listings than any host before
+            if new >= len(self.histogram):
+                self.histogram = np.concatenate((self.histogram, np.zeros(new + 1 - len(self.histogram), dtype=np.int64)))
+            if old > 0:
+                self.histogram[old] -= 1
+            if new > 0:
+                self.histogram[new] += 1
+                self.per_host[host] = new
+            else:
+                del self.per_host[host]
+
+    def add(self, host_ids):
+        """
+        This function adds listings.
+
+        :param host_ids: the host id of each new listing (array)
+        """
+        self._update(host_ids, 1)
+
+    def remove(self, host_ids):
+        """
+        This function removes listings. Removing more listings than a host has raises ValueError.
+
+        :param host_ids: the host id of each removed listing (array)
+        """
+        self._update(host_ids, -1)
+
+    def counts(self):
+        """
+        :return: a list where where l[i] is the number of hosts with i listings (list)
+        """
+        nonzero = np.flatnonzero(self.histogram)
+        size = nonzero[-1] + 1 if len(nonzero) else 1
+        return self.histogram[:size].tolist()
 
 # PART 3
+@_instrumented
+def snapshot_date(filename):
+    """
+    This function finds the date of a snapshot from its file name, which is the text after the last "_" and before
+    ".csv", as in "boston_2015-01-02.csv".
+
+    :param filename: a string that is a file name (str)
+    :return: the date in the file name (str)
+    """
+    # strips the file name of its folders and of ".csv"
+    stripped = os.path.basename(filename)
+    if stripped.lower().endswith(".csv"):
+        stripped = stripped[:-len(".csv")]
+    # the date is the last element after splitting on "_"
+    return stripped.split("_")[-1]
+
+@_instrumented
+def snapshot_city(filename):
+    """
+    This function finds the city of a snapshot from its file name, which is the text before the last "_", as in
+    "boston_2015-01-02.csv".
+
+    :param filename: a string that is a file name (str)
+    :return: the city in the file name (str)
+    """
+    stripped = os.path.basename(filename)
+    if stripped.lower().endswith(".csv"):
+        stripped = stripped[:-len(".csv")]
+    return stripped.rsplit("_", 1)[0]
+
+@_instrumented
 def room_prices(filename_list, roomtype):
     """
     This function takes a list of filenames and the room type as parameters. It organizes the filenames by date and
-    creates a dictionary mapping room ids for a certain roomtype to the change in the room id's price over the years
+    creates a dictionary mapping room ids for a certain roomtype to the change in the room id's price over the years.
+    Any number of files can be given; each one is loaded once, the rows of the room type are looked up with
+    select_rows, and their prices are appended to the room's list. Snapshots this function loads are forgotten once
+    their prices are read, so a long list of files doesn't stay in memory.
     :param filename_list: a list of filenames that are strings (list)
     :param roomtype: a room type (string)
     :return: a dictionary with room ids (int) as keys and a list of prices (float) over time as values
     """
-    file_list = filename_list
-    d = {}
-    new_d = {}
-
-    # creates dictionary mapping dates to file names (not in order)
-    for elem in filename_list:
-        # strips the file name of ".csv"
-        stripped = elem.strip(".csv")
-        # separates the file name into a list of strings based on "_"
-        elem_split = stripped.split("_")
-        # maps the last element of the list (the date) to the file name
-        d[elem_split[-1]] = (elem)
-
-    # turns the keys in the dictionary into a list
-    list_d = list(d)
-
-    # uses insertion sort to sort the list of dates and list of filenames in chronological order
-    for i in range(1, len(list_d)):
-        value = list_d[i]
-        value2 = file_list[i]
-        pos = i
-        while pos>0 and list_d[pos-1]>value:
-            list_d[pos]=list_d[pos-1]
-            file_list[pos] = file_list[pos-1]
-            pos = pos-1
-        list_d[pos]=value
-        file_list[pos]=value2
-
-    # creates an ordered dictionary mapping the reorganized dates to their corresponding file names
-    for elem in file_list:
-        stripped = elem.strip(".csv")
-        elem_split = stripped.split("_")
-        new_d[elem_split[-1]] = (elem)
-
-    id_list = []
-    price_list_1 = []
-    price_list_2 = []
-    price_list_3 = []
-    output_dict = {}
+    # sorts the filenames in chronological order of the dates in their names
+    file_list = sorted(filename_list, key=snapshot_date)
 
-    # opens the first, second, and third files in the ordered list for reading
-    file_in_1 = open(file_list[0], "r")
-    file_in_2 = open(file_list[1], "r")
-    file_in_3 = open(file_list[2], "r")
-
-    # reads the first line in the first file
-    first_line_1 = file_in_1.readline()
-    # reads the following lines in the first file
-    lines_1 = file_in_1.readlines()
-    # splits the first line of the first file into a list based on commas
-    first_split_1 = first_line_1.split(",")
-
-    # reads the first line in the second file
-    first_line_2 = file_in_2.readline()
-    # reads the following lines in the second file
-    lines_2 = file_in_2.readlines()
-    # splits the first line of the second file into a list based on commas
-    first_split_2 = first_line_2.split(",")
-
-    # reads the first line in the third file
-    first_line_3 = file_in_3.readline()
-    # reads the following lines in the third file
-    lines_3 = file_in_3.readlines()
-    # splits the first line of the third file into a list based on commas
-    first_split_3 = first_line_3.split(",")
-
-    # loops over the words in each line in the first file and puts them into a list
-    for words_1 in lines_1:
-        split_1 = words_1.split(",")
-        # loops over the elements in the columns for room id and the rows containing shared room
-        for i in range(len(first_split_1)):
-            for j in range(len(first_split_1)):
-                if first_split_1[i] == "room_id":
-                    if split_1[j] == "Shared room":
-
-                        # loops over the columns under price
-                        for k in range(len(first_split_1)):
-                            if first_split_1[k] == "price":
-
-                                # creates a dictionary mapping room id to corresponding price (list)
-                                output_dict[int(split_1[i])] = [float(split_1[k])]
-
-    # loops over the words in each line in the second file and puts them into a list
-    for words_2 in lines_2:
-        split_2 = words_2.split(",")
-
-        # loops over the elements in the column for room id and the rows containing shared room
-        for i in range(len(first_split_2)):
-            for j in range(len(first_split_2)):
-                if first_split_2[i] == "room_id":
-                        if split_2[j] == "Shared room":
-
-                            # loops over the columns under price
-                            for k in range(len(first_split_2)):
-                                if first_split_2[k] == "price":
-
-                                    # if the room id is already in the keys of the dictionary, appends price to the list of values
-                                    if int(split_2[i]) in list(output_dict):
-                                        output_dict[int(split_2[i])].append(float(split_2[k]))
-                                    # if room id isn't in keys of dictionary, adds it and maps it to price
-                                    else:
-                                        output_dict[int(split_2[i])] = [float(split_2[k])]
-
-
-    # loops over the words in each line in the third file and puts them into a list
-    for words_3 in lines_3:
-        split_3 = words_3.split(",")
-
-        # loops over the elements in the column for room id and the rows containing shared room
-        for i in range(len(first_split_3)):
-            for j in range(len(first_split_3)):
-                if first_split_3[i] == "room_id":
-                        if split_3[j] == "Shared room":
-
-                            # loops over the columns under price
-                            for k in range(len(first_split_3)):
-                                if first_split_3[k] == "price":
-
-                                    # if the room id is already in the keys of the dictionary, appends price to the list of values
-                                    if int(split_3[i]) in list(output_dict):
-                                        output_dict[int(split_3[i])].append(float(split_3[k]))
-                                    # if room id isn't in keys of dictionary, adds it and maps it to price
-                                    else:
-                                        output_dict[int(split_3[i])] = [float(split_3[k])]
+    output_dict = {}
 
+    # loops over the files in chronological order
+    for elem in file_list:
+        # keeps snapshots that were loaded before this call, which the caller may still be using
+        loaded = elem in _snapshots
+        snapshot = load_snapshot(elem)
+        # looks up the rows containing the room type, in file order
+        keep = select_rows(elem, room_type=roomtype)
+
+        for room_id, price in zip(snapshot["room_id"][keep].tolist(), snapshot["price"][keep].tolist()):
+            # if the room id is already in the keys of the dictionary, appends price to the list of values
+            if room_id in output_dict:
+                output_dict[room_id].append(price)
+            # if room id isn't in keys of dictionary, adds it and maps it to price
+            else:
+                output_dict[room_id] = [price]
+        if not loaded:
+            forget_snapshot(elem)
 
     # returns a dictionary where keys are room ids and values are list of prices
     return (output_dict)
 
+@_instrumented
+def price_history_array(d):
+    """
+    This function turns a dictionary of price histories into a padded array with one row per room, so the prices of
+    every room can be worked on at once. Rooms with shorter histories are padded with nan at the end.
+
+    :param d: a dictionary with keys as room ids (int) and values as list of prices (float), (dict)
+    :return: a tuple of the room ids (array), the prices with one row per room (array) and the number of prices of
+    each room (array), (tuple)
+    """
+    room_ids = np.fromiter(d.keys(), dtype=np.int64, count=len(d))
+    lengths = np.fromiter((len(prices) for prices in d.values()), dtype=np.int64, count=len(d))
+    flat = np.fromiter(chain.from_iterable(d.values()), dtype=np.float64, count=int(lengths.sum()))
+
+    # places the i-th price of each room in column i of the room's row
+    prices = np.full((len(d), int(lengths.max()) if len(d) else 0), np.nan)
+    rows = np.repeat(np.arange(len(d)), lengths)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) if len(d) else lengths
+    columns = np.arange(len(flat)) - np.repeat(starts, lengths)
+    prices[rows, columns] = flat
+    return (room_ids, prices, lengths)
+
+@_instrumented
+def price_changes(d):
+    """
+    This function computes the percent change of every room's price from its first to its last price, and from each
+    price to the next one. A change from a price of 0, or from or to a missing price, is nan.
+
+    :param d: a dictionary with keys as room ids (int) and values as list of prices (float), (dict)
+    :return: a dictionary with the arrays "room_ids", "prices" (from price_history_array), "starting", "ending",
+    "total" (first to last percent change, one per room) and "periods" (percent change between consecutive prices,
+    one row per room), (dict)
+    """
+    room_ids, prices, lengths = price_history_array(d)
+    rows = np.arange(len(room_ids))
+    starting = prices[:, 0] if len(room_ids) else np.zeros(0)
+    ending = prices[rows, lengths - 1] if len(room_ids) else np.zeros(0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # divides by nan instead of 0 so a 0 price gives nan rather than inf
+        total = (ending - starting) / np.where(starting == 0, np.nan, starting) * 100
+        earlier = prices[:, :-1]
+        periods = (prices[:, 1:] - earlier) / np.where(earlier == 0, np.nan, earlier) * 100
+    return {"room_ids": room_ids, "prices": prices, "starting": starting, "ending": ending, "total": total,
+            "periods": periods}
+
+@_instrumented
+def top_movers(d, k=100, by="total"):
+    """
+    This function finds the k rooms whose price moved the most, in either direction. The k largest moves are picked
+    with a partial sort, and only those k are sorted. Rooms with the same move are ranked in the order of d, so the
+    first k rooms are the same whatever k is.
+
+    :param d: a dictionary with keys as room ids (int) and values as list of prices (float), (dict)
+    :param k: the number of rooms to return, at least 1 (int)
+    :param by: "total" to rank by the change from first to last price, "period" to rank by the largest change
+    between two consecutive prices (str)
+    :return: a list of up to k tuples of room id (int), percent change (float), starting price (float) and ending
+    price (float), largest move first (list)
+    """
+    if k < 1:
+        raise ValueError("k must be at least 1, not %r" % (k,))
+    changes = price_changes(d)
+    if by == "total":
+        percent = changes["total"]
+        starting = changes["starting"]
+        ending = changes["ending"]
+    elif by == "period":
+        periods = changes["periods"]
+        if periods.shape[1] == 0:
+            return []
+        # picks each room's largest move between two consecutive prices
+        column = np.where(np.isnan(periods), -1.0, np.abs(periods)).argmax(axis=1)
+        rows = np.arange(len(periods))
+        percent = periods[rows, column]
+        starting = changes["prices"][rows, column]
+        ending = changes["prices"][rows, column + 1]
+    else:
+        raise ValueError("by must be \"total\" or \"period\", not %r" % (by,))
+
+    # leaves out rooms without a defined change
+    candidates = np.flatnonzero(~np.isnan(percent))
+    magnitude = np.abs(percent[candidates])
+    k = min(k, len(candidates))
+    if k == 0:
+        return []
+    # keeps every move larger than the kth, and the first of the moves equal to it
+    threshold = magnitude[np.argpartition(-magnitude, k - 1)[k - 1]]
+    larger = np.flatnonzero(magnitude > threshold)
+    top = np.concatenate((larger, np.flatnonzero(magnitude == threshold)[:k - len(larger)]))
+    top = top[np.lexsort((top, -magnitude[top]))]
+    chosen = candidates[top]
+    return list(zip(changes["room_ids"][chosen].tolist(), percent[chosen].tolist(),
+                    starting[chosen].tolist(), ending[chosen].tolist()))
+
+@_instrumented
 def price_change(d):
     """
     This function takes a dictionary with keys as room ids (int) and values as list of prices (float) for the parameter.
     The function returns a tuple with the max percentage change, starting price for listing with max percent change, and
-    ending price for listing with max percentage change
+    ending price for listing with max percentage change. Listings whose starting price is 0 are skipped, and
+    (0, 0, 0) is returned when no listing's price changed.
 
     :param d: a dictionary with keys as room ids (int) and values as list of prices (float), (dict)
     :return: a tuple with three elements: max percent change, starting price for listing with max change, and ending price
     for listing with max percent change, (tuple)
     """
+    changes = price_changes(d)
+    # makes every percent change positive, and leaves out the undefined ones
+    percent = np.abs(changes["total"])
+    percent[np.isnan(percent)] = 0
 
-    list_d = list(d)
-    max = 0
-    starting = 0
-    ending = 0
-
-    # for loop iterates over the number of items in the dictionary
-    for i in range(len(d)):
-        # calculates percent change by subtracting the last price from the first price, all divided by the first price
-        percent_change = ((float(d[list_d[i]][-1])) - (float(d[list_d[i]][0]))) / float((d[list_d[i]][0]))
-        # sets the starting price as the first element from the list of values associated with each key
-        starting = float(d[list_d[i]][0])
-        # sets the ending price as the last element from the list of values associated with each key
-        ending = float(d[list_d[i]][-1])
-        # if the percent change is negative, makes it positive and converts it from decimal to percentage
-        if percent_change < 0:
-            percent_change = (percent_change * -1) * 100
-        # if percent change is positive, converts it from decimal to percentage
-        else:
-            percent_change = percent_change * 100
-
-        # identifies the max percent change by comparing it with previous max values
-        if percent_change > max:
-            max = percent_change
-            # sets max_ending as the ending price associated with the max percent change
-            max_ending = ending
-            # sets max_starting as the ending price associated with the max percent change
-            max_starting = starting
+    # identifies the first listing with the max percent change
+    if len(percent) == 0 or percent.max() <= 0:
+        return (0, 0, 0)
+    i = int(np.argmax(percent))
 
     # returns a tuple with the max percent change, max starting price, and max ending price
-    return (max, max_starting, max_ending)
+    return (float(percent[i]), float(changes["starting"][i]), float(changes["ending"][i]))
 
 # PART 4
-def price_by_neighborhood(filename):
+class QuantileSketch:
+    """
+    This class estimates quantiles of a stream of values in bounded memory. Each value is counted in a bucket whose
+    bounds grow by a constant ratio, so every estimate is within relative_accuracy of a true value and the number of
+    buckets depends only on the range of the values, not on how many there are. Values that are zero or negative are
+    counted together as 0.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        """
+        :param relative_accuracy: the largest relative error of an estimated quantile (float)
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, values):
+        """
+        This function counts an array of values into the sketch.
+
+        :param values: the values to add, without nan (array)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        self.count += len(values)
+        buckets, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        for bucket, count in zip(buckets.tolist(), counts.tolist()):
+            self.bins[bucket] = self.bins.get(bucket, 0) + count
+
+    def merge(self, other):
+        """
+        This function adds the counts of another sketch with the same relative_accuracy to this one.
+
+        :param other: the sketch to merge in (QuantileSketch)
+        """
+        for bucket, count in other.bins.items():
+            self.bins[bucket] = self.bins.get(bucket, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q):
+        """
+        This function estimates the q-th quantile of the values added so far.
+
+        :param q: the quantile, between 0 and 1 (float)
+        :return: the estimated quantile, nan when the sketch is empty (float)
+        """
+        if self.count == 0:
+            return float("nan")
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        buckets = sorted(self.bins)
+        cumulative = np.cumsum([self.bins[bucket] for bucket in buckets]) + self.zeros
+        bucket = buckets[int(np.searchsorted(cumulative, rank, side="right"))]
+        # the middle of the bucket in relative terms
+        return float(2 * self.gamma ** bucket / (self.gamma + 1))
+
+class GroupAggregator:
+    """
+    This class computes the count, sum, mean and quantiles of values per group in one pass. Values can be added in
+    several calls, such as one per chunk of a file, and only the totals and one QuantileSketch per group are kept.
+    """
+
+    def __init__(self, quantiles=(0.5, 0.9), relative_accuracy=0.01):
+        """
+        :param quantiles: the quantiles to report for each group (tuple)
+        :param relative_accuracy: the relative_accuracy of each group's QuantileSketch (float)
+        """
+        self.quantiles = quantiles
+        self.relative_accuracy = relative_accuracy
+        self.counts = {}
+        self.sums = {}
+        self.sketches = {}
+
+    def add(self, keys, values):
+        """
+        This function adds values to their groups. Rows whose value is nan are skipped.
+
+        :param keys: the group of each value, or a tuple of arrays whose rows together form the group (array or tuple)
+        :param values: the values to aggregate (array)
+        :return: the aggregator, so calls can be chained (GroupAggregator)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        keep = ~np.isnan(values)
+        values = values[keep]
+        if len(values) == 0:
+            return self
+
+        # numbers the groups, then sorts the values so each group's values sit next to each other
+        if isinstance(keys, tuple):
+            # numbers each key column and combines the numbers into one code per row, like _index_order
+            columns = [np.unique(np.asarray(column)[keep], return_inverse=True) for column in keys]
+            if np.prod([float(len(names)) for names, _ in columns]) < 2 ** 62:
+                combined = np.zeros(len(values), dtype=np.int64)
+                for names, codes in columns:
+                    combined = combined * len(names) + codes.reshape(-1)
+                distinct, inverse = np.unique(combined, return_inverse=True)
+                # takes each distinct code apart again into the position of its key in every column
+                positions = []
+                for names, _ in reversed(columns):
+                    positions.append(distinct % len(names))
+                    distinct = distinct // len(names)
+                positions.reverse()
+            else:
+                # numbers the distinct rows of the column numbers when one combined code would overflow
+                distinct, inverse = np.unique(np.stack([codes.reshape(-1) for _, codes in columns], axis=1), axis=0,
+                                              return_inverse=True)
+                positions = list(distinct.T)
+            labels = list(zip(*[names[position].tolist() for (names, _), position in zip(columns, positions)]))
+        else:
+            labels, inverse = np.unique(np.asarray(keys)[keep], return_inverse=True)
+            labels = labels.tolist()
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, minlength=len(labels))
+        sums = np.bincount(inverse, values, minlength=len(labels))
+        order = np.argsort(inverse, kind="stable")
+        groups = np.split(values[order], np.cumsum(counts)[:-1])
+
+        for label, count, total, group in zip(labels, counts.tolist(), sums.tolist(), groups):
+            if label not in self.counts:
+                self.counts[label] = 0
+                self.sums[label] = 0.0
+                self.sketches[label] = QuantileSketch(self.relative_accuracy)
+            self.counts[label] += count
+            self.sums[label] += total
+            self.sketches[label].add(group)
+        return self
+
+    def result(self):
+        """
+        This function reports the statistics of every group. Quantiles are named "p" followed by the percent, such as
+        "p90", and the 0.5 quantile is also reported as "median".
+
+        :return: a dictionary mapping each group to a dictionary of its count, sum, mean and quantiles (dict)
+        """
+        output = {}
+        for label, count in self.counts.items():
+            stats = {"count": count, "sum": self.sums[label], "mean": self.sums[label] / count}
+            for q in self.quantiles:
+                stats["p%g" % (q * 100)] = self.sketches[label].quantile(q)
+            if "p50" in stats:
+                stats["median"] = stats["p50"]
+            output[label] = stats
+        return output
+
+@_instrumented
+def group_stats(keys, values, quantiles=(0.5, 0.9)):
+    """
+    This function runs a GroupAggregator over one set of keys and values.
+
+    :param keys: the group of each value, or a tuple of key arrays (array or tuple)
+    :param values: the values to aggregate (array)
+    :param quantiles: the quantiles to report for each group (tuple)
+    :return: a dictionary mapping each group to a dictionary of its statistics (dict)
+    """
+    return GroupAggregator(quantiles).add(keys, values).result()
+
+@_instrumented
+@_memoized
+def neighborhood_price_stats(filename, roomtype="Entire home/apt", chunk_rows=None):
+    """
+    This function computes the count, sum, mean, median and 90th percentile of the price of the room type's listings
+    in each neighborhood. The listings of the room type are looked up with select_rows and aggregated chunk_rows at
+    a time, so only one sketch per neighborhood is kept besides the snapshot.
+
+    :param filename: the name of a file (string)
+    :param roomtype: a room type (string)
+    :param chunk_rows: the largest number of rows aggregated at a time, CHUNK_ROWS when None (int)
+    :return: a dictionary mapping neighborhoods (str) to dictionaries of price statistics (dict)
+    """
+    if chunk_rows is None:
+        chunk_rows = CHUNK_ROWS
+    snapshot = load_snapshot(filename)
+    keep = select_rows(filename, room_type=roomtype)
+
+    aggregator = GroupAggregator()
+    for start in range(0, len(keep), chunk_rows):
+        rows = keep[start:start + chunk_rows]
+        aggregator.add(snapshot["neighborhood"][rows], snapshot["price"][rows])
+    return aggregator.result()
+
+@_instrumented
+@_memoized
+def price_by_neighborhood(filename, roomtype="Entire home/apt"):
     """
     This function takes the name of a file (str) and creates a dictionary mapping a neighborhood to its average price
-    for an entire home/apt listing
+    for a listing of the room type, an entire home/apt listing by default
 
     :param filename: the name of a file (string)
-    :return: a dictionary where neighborhoods are the keys (str) and the neighborhood's average price for an Entire home/apt
-    listing is the value (float), (dict)
-    """
-    # opens filename to read
-    file_in = open(filename, "r")
-    # reads through the first line of the file
-    first_line = file_in.readline()
-    # reads through the folloiwng lines of the file
-    lines = file_in.readlines()
-    # splits the first line of the file into words in a list based on commas
-    first_split = first_line.split(",")
-
-    list_prices = []
-    list_neighborhood = []
+    :param roomtype: a room type (string)
+    :return: a dictionary where neighborhoods are the keys (str) and the neighborhood's average price for a listing of
+    the room type is the value (float), (dict)
+    """
+    snapshot = load_snapshot(filename)
+
+    # looks up the rows containing the room type
+    keep = select_rows(filename, room_type=roomtype)
+
+    # adds up the prices and counts the listings of each neighborhood in one pass
+    with _stage("aggregate"):
+        stats = GroupAggregator(quantiles=()).add(snapshot["neighborhood"][keep], snapshot["price"][keep]).result()
+
+    # maps a neighborhood to the average price of a listing in that neighborhood
     d = {}
-    counter = 0
-    total = 0
-
-    # loops over the words in each line and puts them into a list
-    for words in lines:
-        split = words.split(",")
-
-        # loops over the elements in the columns for price and neighbordhood and the rows containing Entire home/apt
-        for i in range(len(first_split)):
-            for j in range(len(first_split)):
-                for k in range(len(first_split)):
-                    if split[j] == "Entire home/apt":
-                        if first_split[k] == "price":
-                            if first_split[i] == "neighborhood":
-
-                                # if the listed neighborhood is already a key in the dictionary, appends price of another
-                                # listing in the neighborhood to the list of existing values
-                                if split[i] in d.keys():
-                                    d[split[i]].append(split[k])
-                                # otherwise, maps listed neighborhood to the price of listing in the neighborhood (list)
-                                else:
-                                    d[split[i]] = [split[k]]
-    print(d)
-    # loops over each neighborhood listed in the dictionary
-    for key in d.keys():
-        # loops over all the prices associated with a neighborhood
-        for value in d.values():
-            for i in range(len(value)):
-                # adds up all the prices associated with a neighborhood
-                total += float((d[key])[i])
-                # counts the number of prices values associated with a neighborhood
-                counter += 1
-        # calculates the average price of a listing in the neighborhood
-        avg = total / counter
-        # maps a neighborhood to the average price of a listing in that neighborhood
-        d[key] = avg
+    for key in stats:
+        d[key] = stats[key]["mean"]
     # returns the dictionary with neighborhood:average price of listing as key:value pairs
     return d
 
+@_instrumented
 def plot_data(data, format, filename, done):
     """
     This function creates a scatter plot that plots correlation of price and satisfaction against pvalues for the specified file.
@@ -406,20 +1981,446 @@ def plot_data(data, format, filename, done):
     x = data[0]
     # sets y coordinate as the second element in the tuple in the data set
     y = data[1]
-    # plots (x, y) coordinate pairs on the scattergram and uses the label name (from parameters) in the legend
-    plt.plot(x, y, format, label=filename)
-    # labels the x axis
-    plt.xlabel("correlation between price and overall satisfaction (x-axis) ")
-    # labels the y axis
-    plt.ylabel("p-value determining if result is statistically significant (y-axis")
-    # labels the scattergram's title
-    plt.title("scattergram of correlation vs p-value for price and overall satisfaction")
+    with _stage("render"):
+        # plots (x, y) coordinate pairs on the scattergram and uses the label name (from parameters) in the legend
+        plt.plot(x, y, format, label=filename)
+        # labels the x axis
+        plt.xlabel("correlation between price and overall satisfaction (x-axis) ")
+        # labels the y axis
+        plt.ylabel("p-value determining if result is statistically significant (y-axis")
+        # labels the scattergram's title
+        plt.title("scattergram of correlation vs p-value for price and overall satisfaction")
     # only shows legend and scattergram if done is True
     if done:
-        plt.legend()
-        plt.show()
+        with _stage("show"):
+            plt.legend()
+            plt.show()
 
 
+@_instrumented
+def render_correlations(data, labels, filename, title=None):
+    """
+    This function draws the scattergram of plot_data for many snapshots at once and saves it to a file, without
+    pyplot or a display. All points are drawn by one scatter call on a Figure of its own, so it can be called from
+    several threads or processes at the same time. The file type comes from the file name, such as ".png" or ".svg".
+
+    :param data: a list of tuples consisting of correlation and pvalue (both floats), one per snapshot (list)
+    :param labels: a list of names for the snapshots, such as their file names (list)
+    :param filename: the name of the image file to write (str)
+    :param title: the title of the scattergram, the one plot_data uses when None (str)
+    :return: the name of the image file (str)
+    """
+    points = np.asarray(data, dtype=np.float64).reshape(-1, 2)
+    figure = Figure(figsize=(8, 6))
+    axes = figure.add_subplot()
+
+    with _stage("render"):
+        # gives each snapshot its own color and draws every point in one call
+        colors = ["C%d" % (i % 10) for i in range(len(points))]
+        axes.scatter(points[:, 0], points[:, 1], c=colors)
+        axes.set_xlabel("correlation between price and overall satisfaction (x-axis) ")
+        axes.set_ylabel("p-value determining if result is statistically significant (y-axis")
+        axes.set_title(title or "scattergram of correlation vs p-value for price and overall satisfaction")
+        # only lists the snapshots in a legend while there are few enough of them to tell apart
+        if len(labels) <= 10:
+            handles = [Line2D([], [], marker="o", linestyle="", color=color) for color in colors]
+            axes.legend(handles, labels)
+
+    with _stage("save"):
+        figure.savefig(filename)
+    return filename
+
+def _render_job(job):
+    """
+    This function calls render_correlations with the arguments of one job of render_charts.
+
+    :param job: a tuple of data, labels, filename and title (tuple)
+    :return: the name of the image file (str)
+    """
+    return render_correlations(*job)
+
+@_instrumented
+def render_charts(jobs, processes=None):
+    """
+    This function renders many scattergrams in a process pool, one task per chart.
+
+    :param jobs: a list of tuples of data, labels, filename and title, the arguments of render_correlations (list)
+    :param processes: the number of worker processes, one per CPU when None (int)
+    :return: the names of the image files (list)
+    """
+    if not jobs:
+        return []
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker) as pool:
+        return list(pool.map(functools.partial(run_task, _render_job), jobs))
+
+# OUT OF CORE
+# the layout of one row in a shard file; room types and neighborhoods are codes into the manifest's dictionaries,
+# and date is the position of the row's snapshot in the manifest's files
+SHARD_DTYPE = np.dtype([("date", "<i4"), ("room_id", "<i8"), ("host_id", "<i8"), ("room_type", "<i4"),
+                        ("neighborhood", "<i4"), ("reviews", "<i8"), ("overall_satisfaction", "<f8"),
+                        ("price", "<f8")])
+
+# how many times its SHARD_DTYPE size one row of a shard takes up while the shard is analyzed, counting the copies
+# made to filter and sort it and the Python lists of price histories
+SHARD_HEADROOM = 6
+
+def _count_lines(filename):
+    """
+    This function counts the line breaks of a file in binary blocks, which is an upper bound on its number of rows.
+
+    :param filename: a string that is a file name (str)
+    :return: the number of line breaks (int)
+    """
+    lines = 0
+    with open(filename, "rb") as file_in:
+        for block in iter(lambda: file_in.read(BLOCK_CHARS), b""):
+            lines += block.count(b"\n")
+    return lines
+
+def _shard_of(keys, shards):
+    """
+    This function hashes keys into shard numbers. The keys are mixed with a multiplicative hash first, so ids that
+    follow a pattern still spread evenly.
+
+    :param keys: room ids or host ids (array)
+    :param shards: the number of shards (int)
+    :return: the shard number of each key (array)
+    """
+    mixed = (keys.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+    return (mixed % np.uint64(shards)).astype(np.int64)
+
+def _shard_path(folder, shard):
+    """
+    :param folder: the folder of the shards (str)
+    :param shard: the shard number (int)
+    :return: the file name of the shard (str)
+    """
+    return os.path.join(folder, "shard_%05d.bin" % shard)
+
+@_instrumented
+def shard_snapshots(filename_list, folder, key="room_id", memory_mb=512):
+    """
+    This function is the first pass of the out-of-core analysis. It streams every snapshot once and appends each row
+    to the shard file its room id or host id hashes to, so all the rows of a room, or of a host, across every
+    snapshot end up in the same shard. The rows of every snapshot are counted first, and there are enough shards
+    for each one's rows, SHARD_HEADROOM times their SHARD_DTYPE size, to fit in memory_mb; the work of the second
+    pass is done one shard at a time. A manifest describing the shards is saved as manifest.json in the folder.
+
+    :param filename_list: a list of filenames that are strings (list)
+    :param folder: the folder to write the shards to (str)
+    :param key: "room_id" to keep each room's rows together, "host_id" to keep each host's rows together (str)
+    :param memory_mb: the memory one shard may take up while it is analyzed, in MB (int)
+    :return: the manifest, a dictionary with the folder, key, number of shards, and the dates, cities and files of
+    the snapshots, and the room type and neighborhood dictionaries (dict)
+    """
+    if key not in ("room_id", "host_id"):
+        raise ValueError("key must be \"room_id\" or \"host_id\", not %r" % (key,))
+    # orders the snapshots by date like room_prices, and by city on the same date
+    file_list = sorted(filename_list, key=lambda filename: (snapshot_date(filename), snapshot_city(filename)))
+    total = sum(_count_lines(filename) for filename in file_list) * SHARD_DTYPE.itemsize * SHARD_HEADROOM
+    shards = max(1, int(-(-total // int(memory_mb * 2 ** 20))))
+
+    os.makedirs(folder, exist_ok=True)
+    for shard in range(shards):
+        open(_shard_path(folder, shard), "wb").close()
+
+    dictionaries = {"room_type": {}, "neighborhood": {}}
+    for date, filename in enumerate(file_list):
+        for chunk in iter_snapshot_chunks(filename):
+            records = np.empty(len(chunk["room_id"]), dtype=SHARD_DTYPE)
+            records["date"] = date
+            for name, kind in SNAPSHOT_COLUMNS.items():
+                # numbers each distinct room type and neighborhood in the order they are first seen
+                if kind is str:
+                    codes = dictionaries[name]
+                    records[name] = [codes.setdefault(value, len(codes)) for value in chunk[name].tolist()]
+                else:
+                    records[name] = chunk[name]
+
+            # groups the chunk's rows by shard and appends each group to its shard file
+            shard_ids = _shard_of(records[key], shards)
+            order = np.argsort(shard_ids, kind="stable")
+            counts = np.bincount(shard_ids, minlength=shards)
+            pieces = np.split(records[order], np.cumsum(counts)[:-1])
+            for shard in np.flatnonzero(counts).tolist():
+                with open(_shard_path(folder, shard), "ab") as file_out:
+                    file_out.write(pieces[shard].tobytes())
+
+    manifest = {"folder": os.path.abspath(folder), "key": key, "shards": shards,
+                "dates": [snapshot_date(filename) for filename in file_list],
+                "cities": [snapshot_city(filename) for filename in file_list], "files": file_list,
+                "dictionaries": {name: list(codes) for name, codes in dictionaries.items()}}
+    with open(os.path.join(folder, "manifest.json"), "w") as file_out:
+        json.dump(manifest, file_out)
+    return manifest
+
+def load_manifest(folder):
+    """
+    This function reads the manifest shard_snapshots saved in a folder.
+
+    :param folder: the folder of the shards (str)
+    :return: the manifest (dict)
+    """
+    with open(os.path.join(folder, "manifest.json")) as file_in:
+        return json.load(file_in)
+
+def iter_shards(manifest):
+    """
+    This function is a generator that reads the shards one at a time.
+
+    :param manifest: a manifest from shard_snapshots (dict)
+    :return: yields the rows of each shard (array of SHARD_DTYPE)
+    """
+    for shard in range(manifest["shards"]):
+        yield np.fromfile(_shard_path(manifest["folder"], shard), dtype=SHARD_DTYPE)
+
+def _code_of(manifest, name, value):
+    """
+    :param manifest: a manifest from shard_snapshots (dict)
+    :param name: "room_type" or "neighborhood" (str)
+    :param value: a room type or neighborhood (str)
+    :return: the code of value in the manifest's dictionary, -1 when it never appears (int)
+    """
+    values = manifest["dictionaries"][name]
+    return values.index(value) if value in values else -1
+
+def _snapshot_keys(manifest):
+    """
+    This function names each snapshot of a manifest by its city and date, so snapshots of different cities taken on
+    the same date stay apart.
+
+    :param manifest: a manifest from shard_snapshots (dict)
+    :return: a list of (city, date) tuples, in the order of the manifest's files (list)
+    """
+    return list(zip(manifest["cities"], manifest["dates"]))
+
+def _require_key(manifest, key):
+    """
+    This function raises ValueError when the shards weren't split by the key an analysis needs.
+
+    :param manifest: a manifest from shard_snapshots (dict)
+    :param key: "room_id" or "host_id" (str)
+    """
+    if manifest["key"] != key:
+        raise ValueError("this analysis needs shards split by %s, not %s" % (key, manifest["key"]))
+
+@_instrumented
+def sharded_price_histories(manifest, roomtype):
+    """
+    This function is a generator that does the work of room_prices one shard at a time. The shards must be split
+    by room_id. Each room's history is complete in the one shard that has it.
+
+    :param manifest: a manifest from shard_snapshots (dict)
+    :param roomtype: a room type (string)
+    :return: yields, for each shard, a dictionary with room ids (int) as keys and a list of prices (float) over time
+    as values (dict)
+    """
+    _require_key(manifest, "room_id")
+    code = _code_of(manifest, "room_type", roomtype)
+    for records in iter_shards(manifest):
+        records = records[records["room_type"] == code]
+        # sorts by room, then by date, keeping the file order of rows with the same room and date
+        records = records[np.lexsort((records["date"], records["room_id"]))]
+        room_ids, starts = np.unique(records["room_id"], return_index=True)
+        prices = np.split(records["price"], starts[1:]) if len(records) else []
+        yield {room_id: history.tolist() for room_id, history in zip(room_ids.tolist(), prices)}
+
+@_instrumented
+def sharded_top_movers(manifest, roomtype, k=100, by="total"):
+    """
+    This function does the work of top_movers(room_prices(...)) one shard at a time and keeps the k largest moves.
+
+    :param manifest: a manifest from shard_snapshots, split by room_id (dict)
+    :param roomtype: a room type (string)
+    :param k: the number of rooms to return, at least 1 (int)
+    :param by: "total" or "period", as in top_movers (str)
+    :return: a list of up to k tuples of room id, percent change, starting price and ending price (list)
+    """
+    movers = []
+    for histories in sharded_price_histories(manifest, roomtype):
+        movers = sorted(movers + top_movers(histories, k, by), key=lambda mover: -abs(mover[1]))[:k]
+    return movers
+
+@_instrumented
+def sharded_listings_histograms(manifest):
+    """
+    This function does the work of listings_histogram for every snapshot, one shard at a time. The shards must be
+    split by host_id, so each host's listings in a snapshot are all in one shard.
+
+    :param manifest: a manifest from shard_snapshots (dict)
+    :return: a dictionary mapping the (city, date) of each snapshot (tuple) to a list where l[i] is the number of
+    hosts with i listings (dict)
+    """
+    _require_key(manifest, "host_id")
+    totals = [np.zeros(1, dtype=np.int64) for _ in manifest["dates"]]
+    for records in iter_shards(manifest):
+        # counts the listings of each (date, host) pair, then the hosts with each number of listings per date
+        pairs, per_host = np.unique(np.stack((records["date"].astype(np.int64), records["host_id"]), axis=1),
+                                    axis=0, return_counts=True)
+        for date in np.unique(pairs[:, 0]).tolist():
+            histogram = np.bincount(per_host[pairs[:, 0] == date])
+            if len(histogram) > len(totals[date]):
+                histogram[:len(totals[date])] += totals[date]
+                totals[date] = histogram
+            else:
+                totals[date][:len(histogram)] += histogram
+    return {snapshot: total.tolist() for snapshot, total in zip(_snapshot_keys(manifest), totals)}
+
+@_instrumented
+def sharded_neighborhood_stats(manifest, roomtype="Entire home/apt"):
+    """
+    This function does the work of neighborhood_price_stats for every snapshot, one shard at a time. The shards can
+    be split by either key.
+
+    :param manifest: a manifest from shard_snapshots (dict)
+    :param roomtype: a room type (string)
+    :return: a dictionary mapping the (city, date) of each snapshot (tuple) to a dictionary mapping neighborhoods
+    (str) to dictionaries of price statistics (dict)
+    """
+    code = _code_of(manifest, "room_type", roomtype)
+    names = np.array(manifest["dictionaries"]["neighborhood"], dtype=object)
+    aggregators = [GroupAggregator() for _ in manifest["dates"]]
+    for records in iter_shards(manifest):
+        records = records[records["room_type"] == code]
+        for date in np.unique(records["date"]).tolist():
+            rows = records[records["date"] == date]
+            aggregators[date].add(names[rows["neighborhood"]], rows["price"])
+    return {snapshot: aggregator.result() for snapshot, aggregator in zip(_snapshot_keys(manifest), aggregators)}
+
+# BATCH
+@_instrumented
+def find_snapshots(paths):
+    """
+    This function expands folders and glob patterns into the snapshot files they name, in chronological order per city.
+
+    :param paths: folders, glob patterns or file names (list)
+    :return: the file names of the snapshots (list)
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(glob.glob(os.path.join(path, "*.csv")))
+        else:
+            filenames.extend(glob.glob(path))
+    return sorted(set(filenames), key=lambda filename: (snapshot_city(filename), snapshot_date(filename)))
+
+@_instrumented
+def analyze_snapshot(filename):
+    """
+    This function runs the correlation, host listing and neighborhood analyses on one snapshot. It is the task each
+    worker process of run_batch runs. The snapshot is loaded once, every analysis works on its columns, and it is
+    forgotten afterwards so a worker doesn't keep every snapshot it was given.
+
+    :param filename: a string that is a file name (str)
+    :return: a tuple of the snapshot's summary row (dict) and its list of neighborhood rows (list)
+    """
+    row = {"city": snapshot_city(filename), "date": snapshot_date(filename), "file": filename}
+    try:
+        # computes the correlation between price and overall satisfaction
+        prices, ratings = _rated(load_snapshot(filename))
+        row["rated_listings"] = len(prices)
+        row["correlation"], row["pvalue"] = correlation((prices, ratings))
+
+        # counts how many hosts have each number of listings, from the snapshot loaded above
+        frequency = listings_histogram(filename)
+        row["listings"] = sum(i * count for i, count in enumerate(frequency))
+        row["hosts"] = sum(frequency)
+        row["multi_listing_hosts"] = sum(frequency[2:])
+        row["max_listings"] = len(frequency) - 1
+
+        # computes the price statistics of entire homes/apts in each neighborhood, from the same snapshot
+        neighborhoods = []
+        for neighborhood, stats in sorted(neighborhood_price_stats(filename).items()):
+            neighborhoods.append({"city": row["city"], "date": row["date"], "neighborhood": neighborhood,
+                                  "count": stats["count"], "mean": stats["mean"], "median": stats["median"],
+                                  "p90": stats["p90"]})
+        row["error"] = ""
+    # records the error so one bad file doesn't stop the other snapshots
+    except (OSError, ValueError, IndexError, csv.Error) as error:
+        row["error"] = "%s: %s" % (type(error).__name__, error)
+        neighborhoods = []
+    finally:
+        forget_snapshot(filename)
+    return (row, neighborhoods)
+
+@_instrumented
+def run_batch(paths, processes=None):
+    """
+    This function analyzes every snapshot in a process pool, one task per file, and merges the results into two tables.
+
+    :param paths: folders, glob patterns or file names of snapshots (list)
+    :param processes: the number of worker processes, one per CPU when None (int)
+    :return: a tuple of the summary rows, one per snapshot (list), and the neighborhood rows (list)
+    """
+    filenames = find_snapshots(paths)
+    summary = []
+    neighborhoods = []
+    if not filenames:
+        return (summary, neighborhoods)
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker) as pool:
+        for row, rows in pool.map(functools.partial(run_task, analyze_snapshot), filenames):
+            summary.append(row)
+            neighborhoods.extend(rows)
+    return (summary, neighborhoods)
+
+@_instrumented
+def write_table(rows, filename):
+    """
+    This function writes a list of rows with the same keys to a CSV file, or to the standard output for "-".
+
+    :param rows: a list of dictionaries (list)
+    :param filename: a string that is a file name (str)
+    """
+    if not rows:
+        return
+    file_out = sys.stdout if filename == "-" else open(filename, "w", newline="")
+    # uses every key that appears in any row as a column, in the order they first appear
+    fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+    writer = csv.DictWriter(file_out, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+    if file_out is not sys.stdout:
+        file_out.close()
+
+@_instrumented
+def batch_main(argv=None):
+    """
+    This function is the non-interactive entry point. It analyzes the snapshots named on the command line and writes
+    the summary table, and the neighborhood table when asked for.
+
+    :param argv: the command line arguments, sys.argv[1:] when None (list)
+    """
+    parser = argparse.ArgumentParser(description="Analyze Airbnb snapshots in parallel.")
+    parser.add_argument("paths", nargs="+", help="folders, glob patterns or snapshot files")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="number of worker processes")
+    parser.add_argument("-o", "--output", default="-", help="summary CSV file, - for standard output")
+    parser.add_argument("--neighborhoods", default=None, help="neighborhood price CSV file")
+    parser.add_argument("--charts", default=None, help="folder to write one correlation chart per city to")
+    parser.add_argument("--chart-format", default="png", choices=["png", "svg", "pdf"], help="chart file type")
+    args = parser.parse_args(argv)
+
+    summary, neighborhoods = run_batch(args.paths, args.processes)
+    write_table(summary, args.output)
+    if args.neighborhoods:
+        write_table(neighborhoods, args.neighborhoods)
+
+    # draws the correlation of every snapshot of a city, one chart per city
+    if args.charts:
+        os.makedirs(args.charts, exist_ok=True)
+        cities = {}
+        for row in summary:
+            if not row["error"]:
+                cities.setdefault(row["city"], []).append(row)
+        jobs = []
+        for city, rows in sorted(cities.items()):
+            data = [(row["correlation"], row["pvalue"]) for row in rows]
+            labels = [row["date"] for row in rows]
+            filename = os.path.join(args.charts, "%s.%s" % (city, args.chart_format))
+            jobs.append((data, labels, filename, "correlation vs p-value for price and overall satisfaction in " + city))
+        render_charts(jobs, args.processes)
+
+
+@_instrumented
 def main():
     # asks user to input first file name
     filename_1 = input("input the first file name")
@@ -427,18 +2428,15 @@ def main():
     filename_2 = input("input the second file name")
     # asks user to input third file name
     filename_3 = input("input the third file name")
-    # calls price_satisfaction on the first file to return a list of lists
-    l_1 = price_satisfaction(filename_1)
-    # calls correlation to return a tuple with correlation and pvalue for price data and rating
-    data_1 = correlation(l_1)
-    # calls price_satisfaction on the second file to return a list of lists
-    l_2 = price_satisfaction(filename_2)
-    # calls correlation to return a tuple with correlation and pvalue for price data and rating
-    data_2 = correlation(l_2)
-    # calls price_satisfaction on the third file to return a list of lists
-    l_3 = price_satisfaction(filename_3)
-    # calls correlation to return a tuple with correlation and pvalue for price data and rating
-    data_3 = correlation(l_3)
+    # streams the price and rating columns of the first file
+    l_1 = stream_price_satisfaction(filename_1)
+    # streams the price and rating columns of the second file
+    l_2 = stream_price_satisfaction(filename_2)
+    # streams the price and rating columns of the third file
+    l_3 = stream_price_satisfaction(filename_3)
+    # computes the correlation and pvalue for price data and rating of all three files at once
+    correlations, pvalues = spearman_batch([l_1, l_2, l_3])
+    data_1, data_2, data_3 = zip(correlations.tolist(), pvalues.tolist())
 
     # creates but doesn't show a scattergram with blue circles plotting the first file's correlation against pvalue
     plot_data(data_1, "bo", filename_1, False)
@@ -449,4 +2447,8 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # runs the batch analysis when snapshots are named on the command line, otherwise asks for three files
+    if len(sys.argv) > 1:
+        batch_main()
+    else:
+        main()
\ No newline at end of file